@@ -1,13 +1,42 @@
 import os
+import re
+import sys
+import signal
+import socket
+import argparse
+import traceback
+import bisect
+import heapq
+import logging
+import logging.handlers
+import html
+import gzip
+import zlib
+import hashlib
+import mimetypes
 import http.server
 import socketserver
 import urllib.parse
 import mysql.connector
 import json
 import requests
+import requests.adapters
+import http.cookiejar
 import random
+import time
+import queue
+import threading
+import uuid
+import secrets
+from collections import OrderedDict, deque, namedtuple
+from concurrent.futures import Future, ThreadPoolExecutor
 from dotenv import load_dotenv
 
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
 # Load environment variables from .env file
 load_dotenv()
 
@@ -21,377 +50,2580 @@ for var in required_env_vars:
 PORT = int(os.environ.get('PORT', 8000))
 APP_URL = os.getenv("APP_URL")
 SLACK_TOKEN = os.getenv("SLACK_TOKEN")
+SLACK_API_URL = os.getenv("SLACK_API_URL", "https://slack.com/api")
+MAX_WORKERS = int(os.environ.get('MAX_WORKERS', 16))
+REQUEST_QUEUE_SIZE = int(os.environ.get('REQUEST_QUEUE_SIZE', 64))
+KEEPALIVE_TIMEOUT = float(os.environ.get('KEEPALIVE_TIMEOUT', 5))
+# Heroku sends SIGKILL 30 seconds after SIGTERM
+SHUTDOWN_TIMEOUT = float(os.environ.get('SHUTDOWN_TIMEOUT', 25))
+COMPRESS_MIN_SIZE = int(os.environ.get('COMPRESS_MIN_SIZE', 1024))
+COMPRESS_LEVEL = int(os.environ.get('COMPRESS_LEVEL', 6))
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', MAX_WORKERS))
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 5))
+DB_POOL_PING_INTERVAL = float(os.environ.get('DB_POOL_PING_INTERVAL', 30))
+
+METRICS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+class Metrics:
+    # Each thread records into its own shard of plain dicts, so recording takes no lock;
+    # a scrape sums the shards. Series are keyed by (name, labels) with labels a tuple of pairs.
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.local = threading.local()
+        self.shards = []
+        self.lock = threading.Lock()
+        self.meta = {}
+
+    def describe(self, name, kind, help_text):
+        self.meta[name] = (kind, help_text)
+
+    def shard(self):
+        try:
+            return self.local.shard
+        except AttributeError:
+            shard = self.local.shard = ({}, {})
+            with self.lock:
+                self.shards.append(shard)
+            return shard
+
+    def inc(self, name, labels=(), amount=1):
+        counters = self.shard()[0]
+        key = (name, labels)
+        counters[key] = counters.get(key, 0) + amount
+
+    def observe(self, name, labels, seconds):
+        histograms = self.shard()[1]
+        key = (name, labels)
+        series = histograms.get(key)
+        if series is None:
+            # One count per bucket, one for +Inf, then the running sum
+            series = histograms[key] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect.bisect_left(self.buckets, seconds)] += 1
+        series[-1] += seconds
+
+    def snapshot(self):
+        counters, histograms = {}, {}
+        with self.lock:
+            shards = list(self.shards)
+        for shard_counters, shard_histograms in shards:
+            # dict.copy is atomic under the GIL, so a writer can't change a shard mid-copy
+            for key, value in shard_counters.copy().items():
+                counters[key] = counters.get(key, 0) + value
+            for key, series in shard_histograms.copy().items():
+                total = histograms.setdefault(key, [0] * len(series))
+                for index, value in enumerate(list(series)):
+                    total[index] += value
+        return counters, histograms
+
+    def render(self, samples=()):
+        # Prometheus text exposition format 0.0.4; samples are (name, labels, value) read at scrape time
+        counters, histograms = self.snapshot()
+        families = {}
+        for (name, labels), value in counters.items():
+            families.setdefault(name, []).append(f"{name}{self.labels(labels)} {value}")
+        for (name, labels), series in histograms.items():
+            lines, cumulative = families.setdefault(name, []), 0
+            for bound, count in zip(self.buckets + ('+Inf',), series):
+                cumulative += count
+                lines.append(f"{name}_bucket{self.labels(labels + (('le', str(bound)),))} {cumulative}")
+            lines.append(f"{name}_sum{self.labels(labels)} {series[-1]}")
+            lines.append(f"{name}_count{self.labels(labels)} {cumulative}")
+        for name, labels, value in samples:
+            families.setdefault(name, []).append(f"{name}{self.labels(labels)} {value}")
+
+        output = []
+        for name in sorted(families):
+            kind, help_text = self.meta.get(name, ('untyped', ''))
+            output.append(f"# HELP {name} {help_text}")
+            output.append(f"# TYPE {name} {kind}")
+            output.extend(families[name])
+        return "\n".join(output) + "\n"
+
+    def labels(self, labels):
+        if not labels:
+            return ''
+        escape = lambda value: str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        return '{' + ','.join(f'{key}="{escape(value)}"' for key, value in labels) + '}'
+
+metrics = Metrics(METRICS_BUCKETS)
+metrics.describe('app_http_requests_total', 'counter', 'HTTP requests handled, by route, method and status.')
+metrics.describe('app_http_request_errors_total', 'counter', 'HTTP requests that failed with a 5xx or an unhandled exception.')
+metrics.describe('app_http_request_duration_seconds', 'histogram', 'Time to handle an HTTP request, by route.')
+metrics.describe('app_http_requests_in_flight', 'gauge', 'HTTP requests currently being handled.')
+metrics.describe('app_db_query_duration_seconds', 'histogram', 'Time spent in a database query, by query name.')
+metrics.describe('app_db_query_errors_total', 'counter', 'Database queries that raised an error, by query name.')
+metrics.describe('app_outbound_request_duration_seconds', 'histogram', 'Time spent in an outbound HTTP call, by target.')
+metrics.describe('app_outbound_request_errors_total', 'counter', 'Outbound HTTP calls that failed to complete or returned a 5xx, by target.')
+metrics.describe('app_db_pool_connections', 'gauge', 'Database pool connections, by state.')
+metrics.describe('app_db_pool_events_total', 'counter', 'Database pool checkouts, connects, reconnects, waits, timeouts and discards.')
+metrics.describe('app_lookup_cache_events_total', 'counter', 'Lookup cache hits, misses and evictions.')
+metrics.describe('app_lookup_cache_entries', 'gauge', 'Entries held in the lookup cache.')
+metrics.describe('app_oauth_token_events_total', 'counter', 'OAuth token cache hits, fetches and invalidations.')
+metrics.describe('app_slack_outbox_total', 'counter', 'Outbox messages delivered, and chat.postMessage calls attempted including rate-limited and failed ones.')
+metrics.describe('app_slack_queue_depth', 'gauge', 'Outbox messages waiting on the Slack posting limits.')
+metrics.describe('app_slack_throttle_seconds_total', 'counter', 'Time channels waited on their own limit, the workspace limit or a Retry-After.')
+metrics.describe('app_slack_rate_limited_total', 'counter', 'chat.postMessage calls answered with HTTP 429.')
+metrics.describe('app_oauth_state_events_total', 'counter', 'OAuth states issued, and callbacks resolved from memory, from the table, or rejected.')
+metrics.describe('app_slack_token_entries', 'gauge', 'Installations held in the Slack token directory.')
+metrics.describe('app_slack_token_events_total', 'counter', 'Slack token directory hits, misses and evictions.')
+metrics.describe('app_action_index_entries', 'gauge', 'Event keys in the action routing index.')
+metrics.describe('app_action_index_events_total', 'counter', 'Action index lookups, matched actions, incremental refreshes and full reloads.')
+metrics.describe('app_webhook_dedupe_events_total', 'counter', 'Repeated /handleAsync deliveries answered from the dedupe store.')
+metrics.describe('app_outbound_connections_total', 'counter', 'Outbound HTTP requests per host, by new or reused connection.')
+
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+LOG_QUEUE_SIZE = int(os.environ.get('LOG_QUEUE_SIZE', 10000))
+# Fraction of successful requests logged per route, e.g. "handle_async=0.05,show_metrics=0";
+# errors and slow requests are always logged
+LOG_SAMPLE_RATE = float(os.environ.get('LOG_SAMPLE_RATE', 1))
+LOG_SAMPLE_RATES = {route.strip(): float(rate) for route, _, rate in
+                    (item.partition('=') for item in os.environ.get('LOG_SAMPLE_RATES', '').split(',') if '=' in item)}
+LOG_SLOW_REQUEST_MS = float(os.environ.get('LOG_SLOW_REQUEST_MS', 1000))
+TRACE_MAX_SPANS = int(os.environ.get('TRACE_MAX_SPANS', 200))
+REQUEST_ID_RE = re.compile(r'^[\w.-]{1,64}$')
+
+logger = logging.getLogger('app')
+request_context = threading.local()
+
+class RequestTrace:
+    def __init__(self, request_id):
+        self.request_id = request_id
+        self.start = time.perf_counter()
+        self.totals = {}
+        self.counts = {}
+        self.spans = []
+
+    def add(self, kind, name, start, duration):
+        self.totals[kind] = self.totals.get(kind, 0) + duration
+        self.counts[kind] = self.counts.get(kind, 0) + 1
+        if len(self.spans) < TRACE_MAX_SPANS:
+            self.spans.append((kind, name, start - self.start, duration))
+
+def trace_span(kind, name, start, duration):
+    # Records a timed step (db, http, render...) against the request this thread is handling, if any
+    trace = getattr(request_context, 'trace', None)
+    if trace is not None:
+        trace.add(kind, name, start, duration)
+
+class RequestContextFilter(logging.Filter):
+    # Runs on the calling thread, before the record is queued, so it can still see the request
+    def filter(self, record):
+        trace = getattr(request_context, 'trace', None)
+        record.request_id = trace.request_id if trace else None
+        return True
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    # Under load a full queue drops records rather than blocking the request thread
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            metrics.inc('app_log_records_dropped_total')
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'ts': self.formatTime(record, '%Y-%m-%dT%H:%M:%S') + f'.{int(record.msecs):03d}Z',
+            'level': record.levelname.lower(),
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        if getattr(record, 'request_id', None):
+            entry['request_id'] = record.request_id
+        entry.update(getattr(record, 'fields', None) or {})
+        return json.dumps(entry, default=str)
+
+JsonFormatter.converter = time.gmtime
+
+def setup_logging(background=True):
+    # The request threads only put records on a queue; one listener thread formats and writes them.
+    # The pre-fork supervisor logs directly so it has no threads when it forks.
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(JsonFormatter())
+    # A forked worker replaces the handler it inherited from the supervisor
+    logger.handlers.clear()
+    logger.setLevel(LOG_LEVEL)
+    logger.propagate = False
+    if not background:
+        logger.addHandler(stream_handler)
+        return None
+    log_queue = queue.Queue(LOG_QUEUE_SIZE)
+    queue_handler = DroppingQueueHandler(log_queue)
+    queue_handler.addFilter(RequestContextFilter())
+    logger.addHandler(queue_handler)
+    listener = logging.handlers.QueueListener(log_queue, stream_handler)
+    listener.start()
+    return listener
+
+metrics.describe('app_log_records_dropped_total', 'counter', 'Log records dropped because the log queue was full.')
+
+class ConnectionPool:
+    def __init__(self, size, timeout, ping_interval, **connect_args):
+        self.size = size
+        self.timeout = timeout
+        self.ping_interval = ping_interval
+        self.connect_args = connect_args
+        # LIFO keeps the most recently used (and most likely alive) connections hot
+        self.idle = queue.LifoQueue()
+        self.lock = threading.Lock()
+        self.opened = 0
+        # ids of checked-out connections that hit a connection-level error; release() closes them
+        self.broken = set()
+        self.stats = {'checkouts': 0, 'connects': 0, 'reconnects': 0, 'waits': 0, 'timeouts': 0, 'discarded': 0}
+
+    def count(self, name):
+        with self.lock:
+            self.stats[name] += 1
+
+    def connect(self):
+        # Autocommit keeps reads from holding a transaction open while the connection sits idle;
+        # multi-statement writes call start_transaction() explicitly.
+        return mysql.connector.connect(autocommit=True, **self.connect_args)
+
+    def acquire(self):
+        self.count('checkouts')
+        try:
+            db, released_at = self.idle.get_nowait()
+        except queue.Empty:
+            with self.lock:
+                can_open = self.opened < self.size
+                if can_open:
+                    self.opened += 1
+                    self.stats['connects'] += 1
+            if can_open:
+                try:
+                    return self.connect()
+                except mysql.connector.Error:
+                    with self.lock:
+                        self.opened -= 1
+                    raise
+            self.count('waits')
+            try:
+                db, released_at = self.idle.get(timeout=self.timeout)
+            except queue.Empty:
+                self.count('timeouts')
+                raise mysql.connector.errors.PoolError(f"No connection available within {self.timeout}s")
 
-class MyHandler(http.server.SimpleHTTPRequestHandler):
-    def send_html_response(self, template_path, replacements=None):
-        self.send_response(200)
-        self.send_header('Content-type', 'text/html')
-        self.end_headers()
+        # Health check connections that have been idle long enough to be dropped by the server
+        if time.monotonic() - released_at >= self.ping_interval:
+            try:
+                if not db.is_connected():
+                    self.count('reconnects')
+                    db.reconnect(attempts=1)
+            except mysql.connector.Error:
+                self.discard(db)
+                raise
+        return db
+
+    def failed(self, db, err):
+        # Called with the error a query raised. A lost or refused connection (server restart,
+        # dropped socket) is dead; pooled again, LIFO would hand it straight to the next checkout.
+        if isinstance(err, (mysql.connector.errors.OperationalError, mysql.connector.errors.InterfaceError)):
+            self.broken.add(id(db))
+
+    def release(self, db):
+        if id(db) in self.broken:
+            self.broken.discard(id(db))
+            self.discard(db)
+            return
         try:
-            with open(template_path, 'r') as file:
-                template = file.read()
-                if replacements:
-                    for key, value in replacements.items():
-                        template = template.replace(key, value)
-                self.wfile.write(template.encode())
-        except FileNotFoundError:
-            self.send_response(500)
-            self.end_headers()
-            self.wfile.write(b"Error: Template file not found.")
+            if db.in_transaction:
+                db.rollback()
+        except mysql.connector.Error:
+            self.discard(db)
+            return
+        self.idle.put((db, time.monotonic()))
 
-    def do_GET(self):
-        print(f"Requested path: {self.path}")
-
-        if self.path == '/':
-            self.send_html_response('templates/index.html')
-
-        elif self.path.startswith('/assets'):
-            return super().do_GET()
-
-        elif self.path.startswith('/extensions'):
-            extensions_data = self.get_extensions()
-            extensions_html = "".join(
-                f"<tr><td>{extension[2]}</td><td>{extension[3]}</td><td>{extension[4]}</td><td>{extension[5]}</td><td>{extension[8]}</td></tr>"
-                for extension in extensions_data
-            ) or "<tr><td colspan='12'>No extensions found.</td></tr>"
-            self.send_html_response('templates/extensions.html', {"{{ extensions }}": extensions_html})
-
-        elif self.path.startswith('/extension-add'):
-            self.send_html_response('templates/extension-add.html')
-
-        elif self.path.startswith('/accounts/'):
-            acct_id = self.path.split('/')[-1]
-            accounts_data = self.get_account_by_id(acct_id)
-            if not accounts_data:
-                self.send_response(404)
-                self.end_headers()
-                self.wfile.write(b"Account not found.")
-                return
+    def discard(self, db):
+        with self.lock:
+            self.opened -= 1
+            self.stats['discarded'] += 1
+        try:
+            db.close()
+        except mysql.connector.Error:
+            pass
+
+    def metrics(self):
+        with self.lock:
+            idle = self.idle.qsize()
+            return dict(self.stats, size=self.size, open=self.opened, idle=idle, in_use=self.opened - idle)
+
+DEV_MODE = os.getenv('DEV_MODE', 'false').lower() in ('1', 'true', 'yes')
+ASSET_DIR = 'assets'
+ASSET_MAX_AGE = int(os.environ.get('ASSET_MAX_AGE', 31536000))
+COMPRESSIBLE_TYPES = ('text/', 'application/javascript', 'application/json', 'image/svg+xml', 'image/vnd.microsoft.icon')
+FINGERPRINT_RE = re.compile(r'^(.+)\.([0-9a-f]{12})(\.[^./]+)$')
+
+class AssetManifest:
+    def __init__(self, directory, auto_reload=False):
+        self.directory = directory
+        self.root = os.path.realpath(directory)
+        self.auto_reload = auto_reload
+        self.entries = None
+        self.lock = threading.Lock()
+
+    def load(self):
+        entries = {}
+        for dirpath, _, filenames in os.walk(self.directory):
+            for filename in filenames:
+                file_path = os.path.join(dirpath, filename)
+                entries['/' + file_path.replace(os.sep, '/')] = self.build_entry(file_path)
+        self.entries = entries
+        return entries
+
+    def ensure_loaded(self):
+        if self.entries is None:
+            with self.lock:
+                if self.entries is None:
+                    self.load()
+        return self.entries
+
+    def build_entry(self, file_path):
+        stat = os.stat(file_path)
+        with open(file_path, 'rb') as file:
+            content = file.read()
+        digest = hashlib.sha1(content).hexdigest()[:12]
+        content_type = mimetypes.guess_type(file_path)[0] or 'application/octet-stream'
+        variants = {}
+        # Compress once up front; a variant is only kept if it actually saves space
+        if content_type.startswith(COMPRESSIBLE_TYPES) or file_path.endswith('.map'):
+            for encoding, compress in (('br', brotli and brotli.compress), ('gzip', lambda data: gzip.compress(data, 9, mtime=0))):
+                if compress:
+                    compressed = compress(content)
+                    if len(compressed) < len(content) * 0.9:
+                        variants[encoding] = compressed
+        return {
+            'path': file_path,
+            'mtime': stat.st_mtime,
+            'size': stat.st_size,
+            'hash': digest,
+            'etag': f'"{digest}"',
+            'content_type': content_type,
+            'variants': variants,
+        }
 
-            acct_name, acct_url = accounts_data[1], accounts_data[3]
-            installed_extensions_data = self.get_installed_extensions(acct_id)
-            installed_extensions_html = "".join(
-                f"<tr><td>{installed_extension[0]}</td><td>{installed_extension[1]}</td><td>"
-                f"{self.get_extension_link(installed_extension)}</td></tr>"
-                for installed_extension in installed_extensions_data
-            ) or "<tr><td colspan='4'>No extensions are installed yet.</td></tr>"
-
-            available_extensions_data = self.get_available_extensions(acct_id)
-            available_extensions_html = "".join(
-                f"<tr><td>{available_extension[0]}</td><td>{available_extension[1]}</td><td><a href='/{available_extension[2]}/install?account_url={acct_url}'>Install</a></td></tr>"
-                for available_extension in available_extensions_data
-            ) or "<tr><td colspan='4'>No available extensions.</td></tr>"
-
-            self.send_html_response('templates/account-extensions.html', {
-                "{{ account_name }}": acct_name,
-                "{{ installed_extensions }}": installed_extensions_html,
-                "{{ available_extensions }}": available_extensions_html,
-            })
+    def lookup(self, url_path):
+        # Returns (entry, fingerprinted); fingerprinted URLs are name.<hash>.ext aliases of a file
+        entries = self.ensure_loaded()
+        entry, fingerprinted = entries.get(url_path), False
+        if entry is None:
+            match = FINGERPRINT_RE.match(url_path)
+            if match:
+                entry = entries.get(match.group(1) + match.group(3))
+                fingerprinted = entry is not None and entry['hash'] == match.group(2)
+        if self.auto_reload:
+            entry = self.reload(url_path if entry is None else entry['path'], entry)
+        return entry, fingerprinted
+
+    def reload(self, path, entry):
+        file_path = os.path.realpath(path.lstrip('/'))
+        if not file_path.startswith(self.root + os.sep) or not os.path.isfile(file_path):
+            return entry
+        if entry is None or os.path.getmtime(file_path) != entry['mtime']:
+            entry = self.build_entry(os.path.relpath(file_path))
+            self.entries['/' + entry['path'].replace(os.sep, '/')] = entry
+        return entry
+
+    def url_for(self, url_path):
+        entry = self.ensure_loaded().get(url_path)
+        if entry is None or self.auto_reload:
+            return url_path
+        base, ext = os.path.splitext(url_path)
+        return f"{base}.{entry['hash']}{ext}"
+
+asset_manifest = AssetManifest(ASSET_DIR, auto_reload=DEV_MODE)
+# Asset links in templates, relative or absolute, with any ?v= cache-buster
+ASSET_LINK_RE = re.compile(r'((?:href|src)=")(?:\.\./|/)?(assets/[^"?#]+)(?:\?[^"]*)?"')
+
+TEMPLATE_DIR = 'templates'
+PLACEHOLDER_RE = re.compile(r'({{\s*\w+\s*}})')
+
+class TemplateCache:
+    def __init__(self, directory, auto_reload=False, assets=None):
+        self.directory = directory
+        self.auto_reload = auto_reload
+        self.assets = assets
+        self.templates = {}
+
+    def compile(self, template_path):
+        mtime = os.path.getmtime(template_path)
+        with open(template_path, 'r') as file:
+            source = file.read()
+        if self.assets:
+            # Point asset links at absolute, fingerprinted URLs so browsers can cache them for good
+            source = ASSET_LINK_RE.sub(lambda m: f'{m.group(1)}{self.assets.url_for("/" + m.group(2))}"', source)
+        parts = PLACEHOLDER_RE.split(source)
+        # split() alternates literal text (pre-encoded once here) and placeholder names
+        segments = [part.encode() if i % 2 == 0 else part for i, part in enumerate(parts) if part]
+        return mtime, segments
+
+    def load_all(self):
+        for name in sorted(os.listdir(self.directory)):
+            if name.endswith('.html'):
+                self.get(f"{self.directory}/{name}")
+
+    def get(self, template_path):
+        entry = self.templates.get(template_path)
+        if entry is None or (self.auto_reload and os.path.getmtime(template_path) != entry[0]):
+            entry = self.compile(template_path)
+            self.templates[template_path] = entry
+        return entry[1]
+
+    def render(self, template_path, replacements=None):
+        return b"".join(self.iter_render(template_path, replacements))
+
+    def iter_render(self, template_path, replacements=None):
+        # A replacement may be a string or an iterable of strings, which is consumed lazily
+        # so large tables can be streamed while their rows are still being fetched.
+        replacements = replacements or {}
+        for segment in self.get(template_path):
+            if segment.__class__ is bytes:
+                yield segment
+                continue
+            # Unknown placeholders are left in place, as the old str.replace loop did
+            value = replacements.get(segment, segment)
+            if isinstance(value, str):
+                yield value.encode()
+            else:
+                for part in value:
+                    yield part.encode()
+
+template_cache = TemplateCache(TEMPLATE_DIR, auto_reload=DEV_MODE, assets=asset_manifest)
+
+PAGE_SIZE = int(os.environ.get('PAGE_SIZE', 100))
+PAGE_SIZE_MAX = int(os.environ.get('PAGE_SIZE_MAX', 1000))
+STREAM_CHUNK_SIZE = int(os.environ.get('STREAM_CHUNK_SIZE', 16384))
+STREAM_FETCH_SIZE = int(os.environ.get('STREAM_FETCH_SIZE', 100))
+
+def like_pattern(search):
+    escaped = search.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return f"%{escaped}%"
+
+db_pool = ConnectionPool(
+    DB_POOL_SIZE, DB_POOL_TIMEOUT, DB_POOL_PING_INTERVAL,
+    host=os.getenv('MYSQL_HOST'),
+    user=os.getenv('MYSQL_USER'),
+    password=os.getenv('MYSQL_PASSWORD'),
+    database=os.getenv('MYSQL_DB')
+)
+
+class RowStream:
+    # Rows of a query that has already been executed, fetched STREAM_FETCH_SIZE at a time off an
+    # unbuffered cursor. The connection goes back to the pool when the rows run out or on close(),
+    # which is safe to call more than once and before the first row is read.
+    def __init__(self, db, cursor, labels, start, elapsed):
+        self.db = db
+        self.cursor = cursor
+        self.labels = labels
+        # Only time spent in MySQL counts, not the time the consumer spends between fetches
+        self.start = start
+        self.elapsed = elapsed
+        self.rows = iter(())
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        while True:
+            row = next(self.rows, None)
+            if row is not None:
+                return row
+            if self.db is None:
+                raise StopIteration
+            start = time.perf_counter()
+            try:
+                rows = self.cursor.fetchmany(STREAM_FETCH_SIZE)
+            except mysql.connector.Error as err:
+                # Headers are already out by now, so the page just ends early
+                db_pool.failed(self.db, err)
+                metrics.inc('app_db_query_errors_total', self.labels)
+                logger.error("Database error: %s", err)
+                rows = []
+            self.elapsed += time.perf_counter() - start
+            if not rows:
+                self.close()
+                raise StopIteration
+            self.rows = iter(rows)
+
+    def close(self):
+        db, self.db = self.db, None
+        if db is None:
+            return
+        metrics.observe('app_db_query_duration_seconds', self.labels, self.elapsed)
+        trace_span('db', self.labels[0][1], self.start, self.elapsed)
+        try:
+            if db.unread_result:
+                db.consume_results()
+            self.cursor.close()
+        except mysql.connector.Error as err:
+            db_pool.failed(db, err)
+            logger.error("Database error: %s", err)
+        db_pool.release(db)
+
+class ThreadPoolHTTPServer(socketserver.TCPServer):
+    allow_reuse_address = True
+    request_queue_size = REQUEST_QUEUE_SIZE
+
+    def __init__(self, server_address, RequestHandlerClass, max_workers=MAX_WORKERS, listener=None):
+        super().__init__(server_address, RequestHandlerClass, bind_and_activate=listener is None)
+        if listener is not None:
+            # Pre-forked worker: accept from the supervisor's listening socket
+            self.socket.close()
+            self.socket = listener
+            self.server_address = listener.getsockname()
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='http-worker')
+        # Only accept as many connections as there are workers; the rest wait in the listen backlog
+        self.slots = threading.BoundedSemaphore(max_workers)
+        # Set while a new connection is waiting for a worker, so keep-alive connections give theirs up
+        self.saturated = threading.Event()
+
+    def drain(self):
+        # Called from a signal handler: stop accepting, and let keep-alive connections close
+        # after their current response
+        self.saturated.set()
+        threading.Thread(target=self.shutdown, daemon=True).start()
+
+    def process_request(self, request, client_address):
+        if not self.slots.acquire(blocking=False):
+            self.saturated.set()
+            self.slots.acquire()
+            self.saturated.clear()
+        self.executor.submit(self.process_request_worker, request, client_address)
+
+    def process_request_worker(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            self.slots.release()
+
+    def server_close(self):
+        super().server_close()
+        self.executor.shutdown(wait=True)
+
+CACHE_MAX_ENTRIES = int(os.environ.get('CACHE_MAX_ENTRIES', 10000))
+CACHE_TTL = float(os.environ.get('CACHE_TTL', 300))
+CACHE_NEGATIVE_TTL = float(os.environ.get('CACHE_NEGATIVE_TTL', 30))
+
+MISSING = object()
+
+class TTLCache:
+    def __init__(self, max_entries, ttl, negative_ttl=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.negative_ttl = ttl if negative_ttl is None else negative_ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[1] <= time.monotonic():
+                if entry is not None:
+                    del self.entries[key]
+                self.stats['misses'] += 1
+                return MISSING
+            self.entries.move_to_end(key)
+            self.stats['hits'] += 1
+            return entry[0]
+
+    def set(self, key, value, ttl=None):
+        with self.lock:
+            self.store(key, value, ttl)
+
+    def store(self, key, value, ttl):
+        # Callers hold self.lock
+        if ttl is None:
+            # None is cached too, for a shorter time, so unknown keys don't hit the database every time
+            ttl = self.negative_ttl if value is None else self.ttl
+        self.entries[key] = (value, time.monotonic() + ttl)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.stats['evictions'] += 1
+
+    def add(self, key, value, ttl=None):
+        # Stores value only if key is absent or expired; returns MISSING if it was stored,
+        # otherwise the value already there. Check and store happen under one lock.
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[1] > time.monotonic():
+                self.entries.move_to_end(key)
+                self.stats['hits'] += 1
+                return entry[0]
+            self.stats['misses'] += 1
+            self.store(key, value, ttl)
+            return MISSING
+
+    def get_or_load(self, key, loader):
+        # A loader returns MISSING when it couldn't reach the database; that isn't a "not found", so nothing is cached
+        value = self.get(key)
+        if value is MISSING:
+            value = loader()
+            if value is MISSING:
+                return None
+            self.set(key, value)
+        return value
+
+    def invalidate(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def metrics(self):
+        with self.lock:
+            return dict(self.stats, size=len(self.entries))
+
+lookup_cache = TTLCache(CACHE_MAX_ENTRIES, CACHE_TTL, CACHE_NEGATIVE_TTL)
+
+HTTP_CONNECT_TIMEOUT = float(os.environ.get('HTTP_CONNECT_TIMEOUT', 3.05))
+HTTP_READ_TIMEOUT = float(os.environ.get('HTTP_READ_TIMEOUT', 10))
+HTTP_POOL_HOSTS = int(os.environ.get('HTTP_POOL_HOSTS', 20))
+HTTP_POOL_SIZE = int(os.environ.get('HTTP_POOL_SIZE', MAX_WORKERS))
+
+class HttpClient:
+    def __init__(self, pool_hosts, pool_size, timeout):
+        self.timeout = timeout
+        # One adapter keeps a keep-alive connection pool per scheme/host/port
+        self.adapter = requests.adapters.HTTPAdapter(pool_connections=pool_hosts, pool_maxsize=pool_size)
+        self.session = requests.Session()
+        self.session.mount('https://', self.adapter)
+        self.session.mount('http://', self.adapter)
+        # The session is shared across tenants, so never carry cookies from one call to the next
+        self.session.cookies.set_policy(http.cookiejar.DefaultCookiePolicy(allowed_domains=[]))
+
+    def post(self, url, target='other', **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        labels = (('target', target),)
+        start = time.perf_counter()
+        try:
+            response = self.session.post(url, **kwargs)
+        except requests.RequestException:
+            metrics.inc('app_outbound_request_errors_total', labels)
+            raise
+        finally:
+            duration = time.perf_counter() - start
+            metrics.observe('app_outbound_request_duration_seconds', labels, duration)
+            trace_span('http', target, start, duration)
+        if response.status_code >= 500:
+            metrics.inc('app_outbound_request_errors_total', labels)
+        return response
+
+    def metrics(self):
+        pools = self.adapter.poolmanager.pools
+        hosts = {}
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            hosts[f"{pool.scheme}://{pool.host}:{pool.port}"] = {
+                'requests': pool.num_requests,
+                'new_connections': pool.num_connections,
+                'reused_connections': pool.num_requests - pool.num_connections,
+            }
+        return hosts
+
+http_client = HttpClient(HTTP_POOL_HOSTS, HTTP_POOL_SIZE, (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT))
+
+OAUTH_TOKEN_REFRESH_MARGIN = float(os.environ.get('OAUTH_TOKEN_REFRESH_MARGIN', 60))
+OAUTH_TOKEN_DEFAULT_TTL = float(os.environ.get('OAUTH_TOKEN_DEFAULT_TTL', 300))
+
+class TokenError(Exception):
+    pass
+
+class ClientCredentialsTokenCache:
+    def __init__(self, client, refresh_margin, default_ttl):
+        self.client = client
+        self.refresh_margin = refresh_margin
+        self.default_ttl = default_ttl
+        # (token_url, client_id) -> (access_token, refresh_at, expires_at, client_secret)
+        self.tokens = {}
+        self.locks = {}
+        self.lock = threading.Lock()
+        self.stats = {'hits': 0, 'fetches': 0, 'invalidations': 0}
+
+    def key_lock(self, key):
+        with self.lock:
+            return self.locks.setdefault(key, threading.Lock())
+
+    def get(self, token_url, client_id, client_secret):
+        key = (token_url, client_id)
+        entry = self.tokens.get(key)
+        now = time.monotonic()
+        if entry and entry[3] == client_secret and now < entry[2]:
+            if now < entry[1]:
+                self.stats['hits'] += 1
+                return entry[0]
+            # Inside the refresh margin the old token is still valid: one caller refreshes
+            # ahead of expiry while everyone else keeps using it.
+            lock = self.key_lock(key)
+            if not lock.acquire(blocking=False):
+                self.stats['hits'] += 1
+                return entry[0]
+            try:
+                return self.refresh(key, client_secret)
+            except (TokenError, requests.RequestException) as err:
+                logger.warning("Token refresh failed, using current token: %s", err)
+                return entry[0]
+            finally:
+                lock.release()
+
+        # Single-flight: concurrent misses for the same key wait for one token request
+        with self.key_lock(key):
+            entry = self.tokens.get(key)
+            if entry and entry[3] == client_secret and time.monotonic() < entry[1]:
+                self.stats['hits'] += 1
+                return entry[0]
+            return self.refresh(key, client_secret)
+
+    def refresh(self, key, client_secret):
+        token_url, client_id = key
+        self.stats['fetches'] += 1
+        auth_response = self.client.post(token_url, target='oauth_token', data={
+            'grant_type': 'client_credentials', 
+            'client_id': client_id,
+            'client_secret': client_secret
+        })
 
-        elif self.path.startswith('/accounts'):
-            accounts_data = self.get_accounts()
-            accounts_html = "".join(
-                f"<tr><td>{acct_name}</td><td>{acct_friendly_name}</td><td>{acct_url}</td><td>{status}</td><td><a href='/accounts/{acct_id}'>View Installed Extensions</a></td></tr>"
-                for acct_id, acct_name, acct_friendly_name, acct_url, disabled in accounts_data
-                for status in ["Active" if disabled == 0 else "Inactive"]
-            ) or "<tr><td colspan='12'>No accounts found.</td></tr>"
-            self.send_html_response('templates/accounts.html', {"{{ accounts }}": accounts_html})
-
-        elif self.path.startswith('/account-add'):
-            self.send_html_response('templates/account-add.html')
-
-        elif '/install' in self.path:
-            # Parse the query parameters
-            query = urllib.parse.urlparse(self.path).query
-            params = urllib.parse.parse_qs(query)
-            if not 'account_url' in params:
-                self.send_response(400)
-                self.end_headers()
-                self.wfile.write(b"Missing account_url.")
-                return
+        if auth_response.status_code != 200:
+            raise TokenError("Failed to authenticate.")
 
-            self.handle_installation(params['account_url'][0])  # Pass the first account_url
+        token_response = auth_response.json()
+        token = token_response.get('access_token')
+        if not token:
+            raise TokenError("Access token not found in response.")
 
-        elif self.path.startswith('/callback'):
-            extension_code = self.path.split('/')[-1].split('?')[0]
-            extensions_data = self.get_extension_by_code(extension_code)
-            if not extensions_data:
-                self.send_response(404)
-                self.end_headers()
-                self.wfile.write(b"Extension not found.")
-                return
-            
-            self.handle_callback(extension_code)
+        try:
+            expires_in = float(token_response.get('expires_in') or self.default_ttl)
+        except (TypeError, ValueError):
+            expires_in = self.default_ttl
+        now = time.monotonic()
+        refresh_at = now + max(expires_in - self.refresh_margin, expires_in / 2)
+        self.tokens[key] = (token, refresh_at, now + expires_in, client_secret)
+        return token
+
+    def invalidate(self, token_url, client_id):
+        if self.tokens.pop((token_url, client_id), None):
+            self.stats['invalidations'] += 1
+
+oauth_tokens = ClientCredentialsTokenCache(http_client, OAUTH_TOKEN_REFRESH_MARGIN, OAUTH_TOKEN_DEFAULT_TTL)
+
+OAUTH_STATE_TTL = int(os.environ.get('OAUTH_STATE_TTL', 600))
+OAUTH_STATE_MAX_ENTRIES = int(os.environ.get('OAUTH_STATE_MAX_ENTRIES', 10000))
+OAUTH_EXCHANGE_TIMEOUT = float(os.environ.get('OAUTH_EXCHANGE_TIMEOUT', 10))
+
+class PendingInstallStore:
+    # OAuth state -> (installation pk, account id, extension code) for installs waiting on their
+    # callback. The state row is written in the installation's own transaction; the process that
+    # issued it answers from memory and any other worker falls back to the table. A state is
+    # answered from memory only once: a replayed callback is checked against the table's used flag.
+    def __init__(self, pool, cache, ttl):
+        self.pool = pool
+        self.cache = cache
+        self.ttl = ttl
+        self.purged_at = 0
+        self.stats = {'issued': 0, 'memory_hits': 0, 'db_hits': 0, 'rejected': 0}
+
+    def issue(self, cursor, installation_pk, account_id, extension_code):
+        # Runs inside the caller's transaction; call remember() once it commits
+        state = secrets.token_urlsafe(24)
+        if time.monotonic() - self.purged_at > 60:
+            self.purged_at = time.monotonic()
+            cursor.execute('DELETE FROM ct_oauth_states WHERE created_at < NOW() - INTERVAL %s SECOND LIMIT 1000', (self.ttl,))
+        cursor.execute('INSERT INTO ct_oauth_states (state, extension_installation_pk, account_id, extension_code) VALUES (%s, %s, %s, %s)',
+                       (state, installation_pk, account_id, extension_code))
+        self.stats['issued'] += 1
+        return state
+
+    def remember(self, state, installation_pk, account_id, extension_code):
+        self.cache.set(state, (installation_pk, account_id, extension_code), self.ttl)
+
+    def resolve(self, state):
+        pending = self.cache.get(state)
+        if pending is not MISSING:
+            self.cache.invalidate(state)
+            self.stats['memory_hits'] += 1
+            return pending
+        db = self.pool.acquire()
+        try:
+            cursor = db.cursor()
+            try:
+                cursor.execute('''
+                    SELECT extension_installation_pk, account_id, extension_code FROM ct_oauth_states
+                    WHERE state = %s AND used = 0 AND created_at >= NOW() - INTERVAL %s SECOND
+                ''', (state, self.ttl))
+                rows = cursor.fetchall()
+            finally:
+                cursor.close()
+        except mysql.connector.Error as err:
+            self.pool.failed(db, err)
+            raise
+        finally:
+            self.pool.release(db)
+        self.stats['db_hits' if rows else 'rejected'] += 1
+        return tuple(rows[0]) if rows else None
+
+    def complete(self, cursor, state, token):
+        # Stores the token and uses up the state in one statement; False if another callback
+        # already completed this install
+        cursor.execute('''
+            UPDATE ct_extension_installations ei JOIN ct_oauth_states s ON s.extension_installation_pk = ei.pk
+            SET ei.token = %s, s.used = 1
+            WHERE s.state = %s AND s.used = 0
+        ''', (token, state))
+        return cursor.rowcount > 0
+
+pending_installs = PendingInstallStore(db_pool, TTLCache(OAUTH_STATE_MAX_ENTRIES, OAUTH_STATE_TTL), OAUTH_STATE_TTL)
+
+OUTBOX_WORKERS = int(os.environ.get('OUTBOX_WORKERS', 4))
+OUTBOX_BATCH_SIZE = int(os.environ.get('OUTBOX_BATCH_SIZE', 100))
+OUTBOX_MAX_ATTEMPTS = int(os.environ.get('OUTBOX_MAX_ATTEMPTS', 8))
+OUTBOX_BACKOFF_BASE = float(os.environ.get('OUTBOX_BACKOFF_BASE', 2))
+OUTBOX_BACKOFF_MAX = float(os.environ.get('OUTBOX_BACKOFF_MAX', 600))
+OUTBOX_POLL_INTERVAL = float(os.environ.get('OUTBOX_POLL_INTERVAL', 1))
+OUTBOX_LEASE = int(os.environ.get('OUTBOX_LEASE', 60))
+OUTBOX_ENQUEUE_TIMEOUT = float(os.environ.get('OUTBOX_ENQUEUE_TIMEOUT', 5))
+# Per-channel coalescing: 0 sends every message on its own. Claimed rows stay leased while
+# buffered, so the window is capped well inside OUTBOX_LEASE.
+SLACK_COALESCE_WINDOW = min(float(os.environ.get('SLACK_COALESCE_WINDOW', 0)), OUTBOX_LEASE / 4)
+SLACK_COALESCE_MAX_MESSAGES = int(os.environ.get('SLACK_COALESCE_MAX_MESSAGES', 20))
+SLACK_COALESCE_MAX_CHARS = int(os.environ.get('SLACK_COALESCE_MAX_CHARS', 3500))
+SLACK_COALESCE_FORMAT = os.environ.get('SLACK_COALESCE_FORMAT', 'text')
+# Slack's caps: 50 blocks per message, 3000 characters per section block
+SLACK_MAX_BLOCKS = 50
+SLACK_MAX_SECTION_CHARS = 3000
+# Posting limits: chat.postMessage allows about one message per second per channel with short
+# bursts, plus a workspace-wide ceiling. A 429 pauses only the channel that hit it.
+SLACK_CHANNEL_RATE = float(os.environ.get('SLACK_CHANNEL_RATE', 1))
+SLACK_CHANNEL_BURST = float(os.environ.get('SLACK_CHANNEL_BURST', 3))
+SLACK_WORKSPACE_RATE = float(os.environ.get('SLACK_WORKSPACE_RATE', 10))
+SLACK_WORKSPACE_BURST = float(os.environ.get('SLACK_WORKSPACE_BURST', 20))
+SLACK_CHANNEL_QUEUE = int(os.environ.get('SLACK_CHANNEL_QUEUE', 10))
+OUTBOX_DRAIN_TIMEOUT = float(os.environ.get('OUTBOX_DRAIN_TIMEOUT', 10))
+
+# Slack errors that will not go away by retrying the same message
+PERMANENT_SLACK_ERRORS = {
+    'channel_not_found', 'is_archived', 'not_in_channel', 'msg_too_long', 'no_text',
+    'invalid_auth', 'not_authed', 'account_inactive', 'token_revoked', 'missing_scope', 'invalid_arguments'
+}
+
+def send_message_to_slack(channel, message, token, blocks=None):
+    url = f'{SLACK_API_URL}/chat.postMessage'
+    headers = {
+        'Content-Type': 'application/json',
+        'Authorization': f'Bearer {token}'
+    }
+    payload = {
+        'channel': channel,
+        'text': message
+    }
+    if blocks:
+        # With blocks, text is only the notification fallback
+        payload['blocks'] = blocks
+    
+    response = http_client.post(url, target='slack', headers=headers, data=json.dumps(payload))
+    if response.status_code == 429:
+        try:
+            retry_after = float(response.headers.get('Retry-After', 1))
+        except ValueError:
+            retry_after = 1
+        return {'ok': False, 'error': 'ratelimited', 'retry_after': retry_after}
+    return response.json()
+
+class ChannelCoalescer:
+    # Buffers claimed outbox rows per channel and releases each channel's rows as one group once
+    # its window has passed, or earlier when the group is full. Only the poller thread uses it.
+    def __init__(self, window, max_messages, max_chars):
+        self.window = window
+        self.max_messages = max_messages
+        self.max_chars = max_chars
+        # (installation pk, channel) -> [first buffered at, rows, characters]
+        self.buffers = {}
+
+    def add(self, row):
+        # Returns groups that are ready because this row filled them. Channels are per
+        # installation: the same channel name in two workspaces is two channels.
+        ready = []
+        channel, size = (row[5], row[1]), len(row[2]) + 3
+        buffer = self.buffers.get(channel)
+        if row[4]:
+            # Block Kit messages are sent as they are, after whatever was buffered before them
+            if buffer:
+                ready.append(self.buffers.pop(channel)[1])
+            return ready + [[row]]
+        if buffer and buffer[2] + size > self.max_chars:
+            ready.append(self.buffers.pop(channel)[1])
+            buffer = None
+        if buffer is None:
+            buffer = self.buffers[channel] = [time.monotonic(), [], 0]
+        buffer[1].append(row)
+        buffer[2] += size
+        if len(buffer[1]) >= self.max_messages:
+            ready.append(self.buffers.pop(channel)[1])
+        return ready
+
+    def due(self):
+        now = time.monotonic()
+        channels = [channel for channel, buffer in self.buffers.items() if now - buffer[0] >= self.window]
+        return [self.buffers.pop(channel)[1] for channel in channels]
+
+    def drain(self):
+        groups = [buffer[1] for buffer in self.buffers.values()]
+        self.buffers.clear()
+        return groups
+
+    def buffered(self):
+        return sum(len(buffer[1]) for buffer in self.buffers.values())
+
+    def next_due_in(self):
+        if not self.buffers:
+            return None
+        return max(0, min(buffer[0] for buffer in self.buffers.values()) + self.window - time.monotonic())
+
+def combine_messages(rows, format):
+    # One Slack message for a coalesced group: a bulleted digest, or a Block Kit list with the
+    # digest as the notification fallback
+    text = f"{len(rows)} updates:\n" + "\n".join(f"• {row[2]}" for row in rows)
+    if format != 'blocks':
+        return text, None
+    blocks = [{'type': 'section', 'text': {'type': 'mrkdwn', 'text': row[2][:SLACK_MAX_SECTION_CHARS]}}
+              for row in rows[:SLACK_MAX_BLOCKS]]
+    return text, blocks
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def wait_time(self, now):
+        # Seconds until a token is available; refills as a side effect
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return 0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+class SlackScheduler:
+    # Hands outbox groups to the senders as fast as Slack allows. Groups queue per
+    # (workspace, channel); a channel becomes ready when its own bucket and its workspace's
+    # bucket both have a token and it is not paused by a 429.
+    def __init__(self, channel_queue, max_pause):
+        self.channel_queue = channel_queue
+        self.max_pause = max_pause
+        self.lock = threading.Condition()
+        self.queues = {}
+        # Heap of (ready at, seq, key) with one entry per channel that has queued groups
+        self.ready = []
+        self.scheduled = set()
+        self.seq = 0
+        self.channel_buckets = {}
+        self.workspace_buckets = {}
+        self.paused = {}
+        self.depth = 0
+        self.drain_by = None
+        self.leftover = []
+        self.stats = {'channel': 0.0, 'workspace': 0.0, 'retry_after': 0.0}
+        self.rate_limited = 0
+
+    def schedule(self, key, at):
+        self.seq += 1
+        heapq.heappush(self.ready, (at, self.seq, key))
+        self.scheduled.add(key)
+        self.lock.notify()
+
+    def put(self, key, group):
+        # Returns 0 if queued, else how long to defer the rows in the database
+        with self.lock:
+            now = time.monotonic()
+            paused_for = self.paused.get(key, 0) - now
+            if paused_for > self.max_pause:
+                return paused_for
+            pending = self.queues.setdefault(key, deque())
+            if len(pending) >= self.channel_queue:
+                return len(pending) / SLACK_CHANNEL_RATE
+            pending.append(group)
+            self.depth += len(group)
+            if key not in self.scheduled:
+                self.schedule(key, now + max(0, paused_for))
+            return 0
+
+    def get(self):
+        # Blocks for the next group that may be sent; returns None once drained after close()
+        with self.lock:
+            while True:
+                if not self.ready:
+                    if self.drain_by is not None:
+                        return None
+                    self.lock.wait()
+                    continue
+                ready_at, _, key = self.ready[0]
+                now = time.monotonic()
+                if self.drain_by is not None and ready_at > self.drain_by:
+                    # Shutting down and even the earliest channel is only ready past the deadline
+                    # (paused by a 429 or throttled): hand every remaining group back
+                    while self.ready:
+                        self.release(heapq.heappop(self.ready)[2])
+                    return None
+                if ready_at > now:
+                    self.lock.wait(ready_at - now)
+                    continue
+                heapq.heappop(self.ready)
+                pending = self.queues.get(key)
+                if not pending:
+                    self.scheduled.discard(key)
+                    continue
+                wait, reason = self.wait_time(key, now)
+                if wait and self.drain_by is not None and now + wait > self.drain_by:
+                    # Shutting down: hand what would wait past the deadline back to the caller
+                    self.release(key)
+                    continue
+                if wait:
+                    if reason:
+                        self.stats[reason] += wait
+                    self.schedule(key, now + wait)
+                    continue
+                self.channel_buckets[key].tokens -= 1
+                self.workspace_buckets[key[0]].tokens -= 1
+                group = pending.popleft()
+                self.depth -= len(group)
+                if pending:
+                    self.schedule(key, now)
+                else:
+                    del self.queues[key]
+                    self.scheduled.discard(key)
+                return key, group
+
+    def release(self, key):
+        # Callers hold self.lock; the channel's groups go to leftover for the caller of reopen()
+        leftover = self.queues.pop(key, ())
+        self.depth -= sum(len(group) for group in leftover)
+        self.leftover.extend(leftover)
+        self.scheduled.discard(key)
+
+    def wait_time(self, key, now):
+        paused_for = self.paused.get(key, 0) - now
+        if paused_for > 0:
+            # Already counted when the 429 came in
+            return paused_for, None
+        self.paused.pop(key, None)
+        channel = self.channel_buckets.get(key)
+        if channel is None:
+            channel = self.channel_buckets[key] = TokenBucket(SLACK_CHANNEL_RATE, SLACK_CHANNEL_BURST)
+        workspace = self.workspace_buckets.get(key[0])
+        if workspace is None:
+            workspace = self.workspace_buckets[key[0]] = TokenBucket(SLACK_WORKSPACE_RATE, SLACK_WORKSPACE_BURST)
+        wait = channel.wait_time(now)
+        if wait:
+            return wait, 'channel'
+        return workspace.wait_time(now), 'workspace'
+
+    def pause(self, key, seconds, group):
+        # After a 429: the group goes back to the head of its channel. Returns the groups to hand
+        # back to the database when the pause would outlast their lease.
+        with self.lock:
+            self.rate_limited += 1
+            self.stats['retry_after'] += seconds
+            self.paused[key] = time.monotonic() + seconds
+            if seconds > self.max_pause:
+                released = [group] + list(self.queues.pop(key, ()))
+                self.depth -= sum(len(queued) for queued in released[1:])
+                return released
+            self.queues.setdefault(key, deque()).appendleft(group)
+            self.depth += len(group)
+            if key not in self.scheduled:
+                self.schedule(key, self.paused[key])
+            return []
 
-        elif '/actions' in self.path:
-            installation_id = self.path.split('/')[1]  
-            extension_installations_data = self.get_extension_installation_by_id(installation_id)
-            if not extension_installations_data:
-                self.send_response(404)
-                self.end_headers()
-                self.wfile.write(b"Extension Installation not found.")
-                return
-            
-            extension_installation_pk, acct_id = extension_installations_data[0], extension_installations_data[1]
-            accounts_data = self.get_account_by_id(acct_id)
-            if not accounts_data:
-                self.send_response(404)
-                self.end_headers()
-                self.wfile.write(b"Account not found.")
+    def close(self, timeout):
+        with self.lock:
+            self.drain_by = time.monotonic() + timeout
+            self.lock.notify_all()
+
+    def reopen(self):
+        # Returns groups left over from the last close()
+        with self.lock:
+            self.drain_by = None
+            leftover, self.leftover = self.leftover, []
+            return leftover
+
+    def prune(self):
+        # Drops buckets that have refilled completely; a fresh bucket behaves the same
+        with self.lock:
+            now = time.monotonic()
+            for buckets in (self.channel_buckets, self.workspace_buckets):
+                for key in [key for key, bucket in buckets.items() if bucket.tokens + (now - bucket.updated) * bucket.rate >= bucket.burst]:
+                    del buckets[key]
+            for key in [key for key, until in self.paused.items() if until <= now]:
+                del self.paused[key]
+
+SLACK_TOKEN_TTL = float(os.environ.get('SLACK_TOKEN_TTL', 600))
+SLACK_TOKEN_MAX_ENTRIES = int(os.environ.get('SLACK_TOKEN_MAX_ENTRIES', 10000))
+# Tokens Slack no longer accepts; the directory drops them so a re-install is picked up
+REVOKED_SLACK_TOKEN_ERRORS = {'invalid_auth', 'account_inactive', 'token_revoked'}
+
+class SlackTokenDirectory:
+    # Installation pk -> the bot token its OAuth callback stored. Warmed with every stored token
+    # at startup and updated by the callback in the process that served it; other processes read
+    # the token from the table on first use. Messages without an installation use SLACK_TOKEN.
+    def __init__(self, pool, cache, default_token):
+        self.pool = pool
+        self.cache = cache
+        self.default_token = default_token
+
+    def get(self, installation_pk):
+        # None while the installation has no token. That isn't cached: the callback storing it may
+        # run in another worker, and this one has to see it on the next attempt.
+        if installation_pk is None:
+            return self.default_token
+        token = self.cache.get(installation_pk)
+        if token is MISSING:
+            token = self.load(installation_pk)
+            if token:
+                self.cache.set(installation_pk, token)
+        return token
+
+    def set(self, installation_pk, token):
+        self.cache.set(installation_pk, token)
+
+    def invalidate(self, installation_pk):
+        self.cache.invalidate(installation_pk)
+
+    def warm(self):
+        rows = self.query('SELECT pk, token FROM ct_extension_installations WHERE token IS NOT NULL ORDER BY pk DESC LIMIT %s',
+                          (self.cache.max_entries,))
+        for installation_pk, token in rows:
+            self.cache.set(installation_pk, token)
+        return len(rows)
+
+    def load(self, installation_pk):
+        rows = self.query('SELECT token FROM ct_extension_installations WHERE pk = %s', (installation_pk,))
+        return rows[0][0] if rows else None
+
+    def query(self, query, params):
+        db = self.pool.acquire()
+        try:
+            cursor = db.cursor()
+            try:
+                cursor.execute(query, params)
+                return cursor.fetchall()
+            finally:
+                cursor.close()
+        except mysql.connector.Error as err:
+            self.pool.failed(db, err)
+            raise
+        finally:
+            self.pool.release(db)
+
+slack_tokens = SlackTokenDirectory(db_pool, TTLCache(SLACK_TOKEN_MAX_ENTRIES, SLACK_TOKEN_TTL), SLACK_TOKEN)
+
+class SlackOutbox:
+    def __init__(self, pool, workers, batch_size, coalescer=None):
+        self.pool = pool
+        self.workers = workers
+        self.batch_size = batch_size
+        self.coalescer = coalescer
+        self.writes = queue.Queue()
+        # Rows stay leased while queued, so a channel never waits on the scheduler for more than half the lease
+        self.scheduler = SlackScheduler(SLACK_CHANNEL_QUEUE, OUTBOX_LEASE / 2)
+        self.wakeup = threading.Event()
+        self.stopping = threading.Event()
+        self.loops = []
+        self.senders = []
+
+    def start(self, deliver=True):
+        # With pre-forked workers every process writes to the outbox but only one delivers,
+        # so the Slack rate limits are tracked in one place
+        self.stopping.clear()
+        self.loops = [threading.Thread(target=self.write_loop, name='outbox-writer', daemon=True)]
+        self.senders = []
+        if deliver:
+            self.loops.append(threading.Thread(target=self.poll_loop, name='outbox-poller', daemon=True))
+            self.senders = [threading.Thread(target=self.send_loop, name=f'outbox-sender-{i}', daemon=True)
+                            for i in range(self.workers)]
+        for thread in self.loops + self.senders:
+            thread.start()
+
+    def stop(self):
+        # Flush pending inserts and stop claiming first, then let senders finish what they hold
+        self.stopping.set()
+        self.wakeup.set()
+        for thread in self.loops:
+            thread.join()
+        self.scheduler.close(OUTBOX_DRAIN_TIMEOUT)
+        for thread in self.senders:
+            thread.join()
+        self.loops, self.senders = [], []
+        # Whatever was still throttled goes back to the table for the next process
+        for rows in self.scheduler.reopen():
+            self.defer(rows, 0)
+
+    def enqueue(self, extension_code, channel, message):
+        self.enqueue_many(extension_code, [(channel, message, None, None)])
+
+    def enqueue_many(self, extension_code, messages):
+        # Takes (channel, text, Block Kit JSON or None, installation pk or None) tuples and blocks
+        # until the rows are committed; concurrent callers share one multi-row INSERT
+        futures = []
+        for message in messages:
+            future = Future()
+            self.writes.put(((extension_code,) + tuple(message), future))
+            futures.append(future)
+        deadline = time.monotonic() + OUTBOX_ENQUEUE_TIMEOUT
+        for future in futures:
+            future.result(timeout=max(0, deadline - time.monotonic()))
+
+    def execute(self, query, params=None, many=False):
+        db = self.pool.acquire()
+        try:
+            cursor = db.cursor()
+            if many:
+                cursor.executemany(query, params)
+            else:
+                cursor.execute(query, params or ())
+            rows = cursor.fetchall() if cursor.with_rows else []
+            cursor.close()
+            return rows
+        except mysql.connector.Error as err:
+            self.pool.failed(db, err)
+            raise
+        finally:
+            self.pool.release(db)
+
+    def write_loop(self):
+        while not (self.stopping.is_set() and self.writes.empty()):
+            try:
+                batch = [self.writes.get(timeout=0.5)]
+            except queue.Empty:
+                continue
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.writes.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self.execute('INSERT INTO ct_slack_outbox (extension_code, channel, message, blocks, extension_installation_pk) VALUES (%s, %s, %s, %s, %s)',
+                             [row for row, _ in batch], many=True)
+            except Exception as err:
+                logger.error("Outbox insert error: %s", err)
+                for _, future in batch:
+                    future.set_exception(err)
+                continue
+            for _, future in batch:
+                future.set_result(None)
+            self.wakeup.set()
+
+    def claim(self, limit):
+        # Claiming pushes next_attempt_at out by the lease, so rows held by a crashed
+        # process become due again on their own after a restart.
+        claim_token = uuid.uuid4().hex
+        self.execute("""
+            UPDATE ct_slack_outbox SET claim_token = %s, next_attempt_at = NOW() + INTERVAL %s SECOND
+            WHERE status = 'pending' AND next_attempt_at <= NOW()
+            ORDER BY id LIMIT %s
+        """, (claim_token, OUTBOX_LEASE, limit))
+        return self.execute("SELECT id, channel, message, attempts, blocks, extension_installation_pk FROM ct_slack_outbox WHERE claim_token = %s ORDER BY id",
+                            (claim_token,))
+
+    def token_for(self, rows):
+        # Every row in a group belongs to one installation; its token also picks the
+        # workspace rate-limit bucket
+        return slack_tokens.get(rows[0][5])
+
+    def schedule(self, group):
+        try:
+            token = self.token_for(group)
+        except mysql.connector.Error as err:
+            # The rows stay leased and are claimed again once the lease runs out
+            logger.error("Slack token lookup error: %s", err)
+            return
+        if token is None:
+            # Never posted with SLACK_TOKEN, which would land in the operator's workspace. Retried
+            # with backoff in case the OAuth callback is still completing, and failed after
+            # OUTBOX_MAX_ATTEMPTS if it never does.
+            self.fail(group, 'missing_token')
+            return
+        key = (token, group[0][1])
+        defer_for = self.scheduler.put(key, group)
+        if defer_for:
+            self.defer(group, defer_for)
+
+    def poll_loop(self):
+        # Jobs are groups of rows for one channel; without a coalescer every group is one row
+        last_prune = time.monotonic()
+        while not self.stopping.is_set():
+            self.wakeup.clear()
+            rows = []
+            # Queued and buffered rows are still leased, so keep at most one claim batch of them
+            free = self.batch_size - self.scheduler.depth
+            if self.coalescer:
+                free -= self.coalescer.buffered()
+            if free > 0:
+                try:
+                    rows = self.claim(free)
+                except Exception as err:
+                    logger.error("Outbox claim error: %s", err)
+            for row in rows:
+                for group in (self.coalescer.add(row) if self.coalescer else [[row]]):
+                    self.schedule(group)
+            wait = OUTBOX_POLL_INTERVAL
+            if self.coalescer:
+                for group in self.coalescer.due():
+                    self.schedule(group)
+                due_in = self.coalescer.next_due_in()
+                if due_in is not None:
+                    wait = min(wait, due_in)
+            if time.monotonic() - last_prune > 60:
+                self.scheduler.prune()
+                last_prune = time.monotonic()
+            if len(rows) < free or free <= 0:
+                self.wakeup.wait(wait)
+        if self.coalescer:
+            # Flush on shutdown; stop() only closes the scheduler after this
+            for group in self.coalescer.drain():
+                self.schedule(group)
+
+    def send_loop(self):
+        while True:
+            job = self.scheduler.get()
+            if job is None:
                 return
+            try:
+                self.deliver(*job)
+            except Exception as err:
+                # The lease expires and the rows are retried
+                logger.error("Outbox delivery error: %s", err)
+
+    def deliver(self, key, rows):
+        token, channel = key
+        if len(rows) == 1:
+            message, blocks = rows[0][2], json.loads(rows[0][4]) if rows[0][4] else None
+        else:
+            message, blocks = combine_messages(rows, SLACK_COALESCE_FORMAT)
+        # Sender threads each record into their own metrics shard
+        metrics.inc('app_slack_outbox_total', (('event', 'slack_calls'),))
+        try:
+            slack_response = send_message_to_slack(channel, message, token, blocks)
+            error = None if slack_response.get('ok') else (slack_response.get('error') or 'unknown_error')
+        except (requests.RequestException, ValueError) as err:
+            error = f"{type(err).__name__}: {err}"
+
+        if error == 'ratelimited':
+            # Not a failed attempt: only this channel waits out Retry-After
+            retry_after = slack_response.get('retry_after', 1)
+            for group in self.scheduler.pause(key, retry_after, rows):
+                self.defer(group, retry_after)
+            return
 
-            acct_name, acct_url = accounts_data[1], accounts_data[3]
-            actions_data = self.get_actions(extension_installation_pk)
-            actions_html = "".join(
-                f"<tr><td>{actions[4]}</td><td>{actions[6]}</td><td>{actions[7]}</td><td>{actions[9]}</td><td>{actions[10]}</td><td>{actions[5]}</td></tr>"
-                for actions in actions_data
-            ) or "<tr><td colspan='12'>No extension actions found.</td></tr>"
-            self.send_html_response('templates/actions.html', {
-                "{{ actions }}": actions_html,
-                "{{ acct_id }}": f"{acct_id}",
-                "{{ account_name }}": acct_name,
-                "{{ installation_id }}": f"{installation_id}"
-            })
+        if error is None:
+            self.update_rows("status = 'sent', attempts = attempts + 1, claim_token = NULL, sent_at = NOW()", (), rows)
+            metrics.inc('app_slack_outbox_total', (('event', 'messages'),), len(rows))
+            return
+        if error in REVOKED_SLACK_TOKEN_ERRORS and rows[0][5] is not None:
+            slack_tokens.invalidate(rows[0][5])
+        self.fail(rows, error)
+
+    def fail(self, rows, error):
+        # A combined message fails or succeeds as a whole, but each row keeps its own attempt count
+        if error in PERMANENT_SLACK_ERRORS:
+            failed, retry = rows, []
+        else:
+            failed = [row for row in rows if row[3] + 1 >= OUTBOX_MAX_ATTEMPTS]
+            retry = [row for row in rows if row[3] + 1 < OUTBOX_MAX_ATTEMPTS]
+        if failed:
+            logger.warning("Outbox messages %s failed: %s", [row[0] for row in failed], error)
+            self.update_rows("status = 'failed', attempts = attempts + 1, claim_token = NULL, last_error = %s", (error[:255],), failed)
+        if retry:
+            # Exponential backoff with jitter
+            attempts = max(row[3] for row in retry) + 1
+            delay = min(OUTBOX_BACKOFF_MAX, OUTBOX_BACKOFF_BASE ** attempts) * random.uniform(0.5, 1.0)
+            self.update_rows("attempts = attempts + 1, claim_token = NULL, last_error = %s, next_attempt_at = NOW() + INTERVAL %s SECOND",
+                             (error[:255], int(delay) or 1), retry)
+
+    def defer(self, rows, seconds):
+        # Releases claimed rows without counting an attempt
+        self.update_rows("claim_token = NULL, next_attempt_at = NOW() + INTERVAL %s SECOND", (int(seconds + 0.999),), rows)
+
+    def update_rows(self, assignments, params, rows):
+        placeholders = ', '.join(['%s'] * len(rows))
+        self.execute(f"UPDATE ct_slack_outbox SET {assignments} WHERE id IN ({placeholders})",
+                     params + tuple(row[0] for row in rows))
+
+slack_coalescer = None
+if SLACK_COALESCE_WINDOW > 0:
+    slack_coalescer = ChannelCoalescer(SLACK_COALESCE_WINDOW, min(SLACK_COALESCE_MAX_MESSAGES, SLACK_MAX_BLOCKS), SLACK_COALESCE_MAX_CHARS)
+slack_outbox = SlackOutbox(db_pool, OUTBOX_WORKERS, OUTBOX_BATCH_SIZE, slack_coalescer)
+
+DEDUPE_MAX_ENTRIES = int(os.environ.get('DEDUPE_MAX_ENTRIES', 100000))
+DEDUPE_TTL = float(os.environ.get('DEDUPE_TTL', 3600))
+# How long an in-progress delivery blocks its retries if it never finishes
+DEDUPE_PENDING_TTL = float(os.environ.get('DEDUPE_PENDING_TTL', 60))
+DEDUPE_DB_STORE = os.getenv('DEDUPE_DB_STORE', 'false').lower() in ('1', 'true', 'yes')
+DEDUPE_HEADERS = [header.strip() for header in os.environ.get('DEDUPE_HEADERS', 'X-Delivery-ID,Idempotency-Key').split(',') if header.strip()]
+
+class DeliveryDedupe:
+    # Remembers recent /handleAsync deliveries so upstream retries don't queue the same Slack
+    # message twice. Memory answers repeats within this process; the optional table also
+    # catches retries that land on another process or arrive after a restart.
+    def __init__(self, cache, pool=None, ttl=DEDUPE_TTL, pending_ttl=DEDUPE_PENDING_TTL):
+        self.cache = cache
+        self.pool = pool
+        self.ttl = ttl
+        self.pending_ttl = pending_ttl
+        self.purged_at = 0
+        self.stats = {'duplicates': 0, 'in_progress': 0, 'db_duplicates': 0}
+
+    def claim(self, key):
+        # Returns None if the caller now owns the delivery, else 'pending' or 'done'
+        state = self.cache.add(key, 'pending', self.pending_ttl)
+        if state is not MISSING:
+            self.stats['duplicates' if state == 'done' else 'in_progress'] += 1
+            return state
+        if self.pool is not None and not self.claim_db(key):
+            self.stats['db_duplicates'] += 1
+            self.cache.set(key, 'done')
+            return 'done'
+        return None
+
+    def finish(self, key, delivered):
+        if delivered:
+            self.cache.set(key, 'done')
+            return
+        # Let the upstream retry go through
+        self.cache.invalidate(key)
+        if self.pool is not None:
+            self.execute('DELETE FROM ct_webhook_deliveries WHERE extension_code = %s AND delivery_key = %s', key)
+
+    def claim_db(self, key):
+        # Inserted: 1 row. An expired row is taken over: 2. A live duplicate changes nothing: 0.
+        rowcount = self.execute('''
+            INSERT INTO ct_webhook_deliveries (extension_code, delivery_key) VALUES (%s, %s)
+            ON DUPLICATE KEY UPDATE created_at = IF(created_at < NOW() - INTERVAL %s SECOND, NOW(), created_at)
+        ''', key + (int(self.ttl),))
+        if time.monotonic() - self.purged_at > 60:
+            self.purged_at = time.monotonic()
+            self.execute('DELETE FROM ct_webhook_deliveries WHERE created_at < NOW() - INTERVAL %s SECOND LIMIT 1000', (int(self.ttl),))
+        return rowcount != 0
+
+    def execute(self, query, params):
+        db = self.pool.acquire()
+        try:
+            cursor = db.cursor()
+            try:
+                cursor.execute(query, params)
+                return cursor.rowcount
+            finally:
+                cursor.close()
+        except mysql.connector.Error as err:
+            self.pool.failed(db, err)
+            raise
+        finally:
+            self.pool.release(db)
+
+webhook_deliveries = DeliveryDedupe(TTLCache(DEDUPE_MAX_ENTRIES, DEDUPE_TTL), db_pool if DEDUPE_DB_STORE else None)
+
+# New actions and webhooks are picked up every ACTION_INDEX_REFRESH seconds (at once in the process
+# that adds them); a full rebuild every ACTION_INDEX_RELOAD seconds drops deleted installations and webhooks.
+ACTION_INDEX_REFRESH = float(os.environ.get('ACTION_INDEX_REFRESH', 30))
+ACTION_INDEX_RELOAD = float(os.environ.get('ACTION_INDEX_RELOAD', 600))
+# Outgoing webhooks are registered for 'table.record' + the action's event type
+EVENT_TYPE_PREFIX = 'table.record'
+
+# {{ and }} are literal braces; a lone brace is kept as it is
+TEMPLATE_FIELD_RE = re.compile(r'\{\{|\}\}|\{([^{}]+)\}|[{}]')
+
+def slack_escape(text):
+    # The three characters Slack's mrkdwn needs escaped in message text
+    return text.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+
+def json_escape(text):
+    return json.encoder.encode_basestring(text)[1:-1]
+
+def format_escape(text):
+    return text.replace('{', '{{').replace('}', '}}')
+
+def truncate_text(text, limit):
+    return text if len(text) <= limit else text[:max(limit - 1, 0)] + '…'
+
+# {path|filter:arg|...}; values are escaped for Slack unless the field ends with |raw
+MESSAGE_FILTERS = {
+    'upper': lambda text, arg: text.upper(),
+    'lower': lambda text, arg: text.lower(),
+    'title': lambda text, arg: text.title(),
+    'strip': lambda text, arg: text.strip(),
+    'truncate': truncate_text,
+    'default': lambda text, arg: text or arg,
+    'raw': None,
+}
+
+def compile_path(path):
+    # 'Caller.Name' or 'Items.0.Id' -> a function reading that path from a record, or None
+    keys = tuple(int(key) if key.isdigit() else key for key in path.strip().split('.'))
+    if '' in keys:
+        raise ValueError(f"Invalid field path: {path!r}")
+    if len(keys) == 1 and isinstance(keys[0], str):
+        key = keys[0]
+        return lambda record: record.get(key)
+
+    def get(record):
+        value = record
+        for key in keys:
+            try:
+                value = value[key]
+            except (KeyError, IndexError, TypeError):
+                return None
+        return value
+    return get
+
+def format_value(value):
+    if value is None:
+        return ''
+    if value.__class__ is str:
+        return value
+    if isinstance(value, (dict, list)):
+        return json.dumps(value)
+    return str(value)
+
+def compile_field(spec):
+    path, *filters = spec.split('|')
+    get = compile_path(path)
+    steps = []
+    for step in filters:
+        name, _, arg = step.strip().partition(':')
+        if name not in MESSAGE_FILTERS:
+            raise ValueError(f"Unknown template filter: {name!r}")
+        if name == 'truncate':
+            arg = int(arg or 80)
+        if MESSAGE_FILTERS[name]:
+            steps.append((MESSAGE_FILTERS[name], arg))
+    escape = 'raw' not in (step.strip() for step in filters)
+    if not steps and escape:
+        # The common case gets no per-filter loop
+        return lambda record: slack_escape(format_value(get(record)))
+
+    def render(record):
+        text = format_value(get(record))
+        for apply, arg in steps:
+            text = apply(text, arg)
+        return slack_escape(text) if escape else text
+    return render
+
+def parse_template(source, specs, in_json=False):
+    # Returns a str.format string with a numbered field per placeholder; specs collects the
+    # distinct field specs, so a field used twice is rendered once. in_json: the result goes
+    # inside a JSON string literal.
+    out, pos = [], 0
+    for match in TEMPLATE_FIELD_RE.finditer(source):
+        literal = source[pos:match.start()] + (match.group(0)[0] if match.group(1) is None else '')
+        out.append(format_escape(json_escape(literal) if in_json else literal))
+        spec = match.group(1)
+        if spec is not None:
+            if spec not in specs:
+                specs.append(spec)
+            out.append('{%d}' % specs.index(spec))
+        pos = match.end()
+    tail = source[pos:]
+    out.append(format_escape(json_escape(tail) if in_json else tail))
+    return ''.join(out)
+
+class MessageTemplate:
+    # 'Incident {Number} is {Status|upper}' compiled once into a format string and one function
+    # per field, so rendering is a single str.format call.
+    def __init__(self, source):
+        specs = []
+        self.format = parse_template(source, specs).format
+        self.fields = tuple(compile_field(spec) for spec in specs)
+
+    def render(self, record):
+        return self.format(*[field(record) for field in self.fields])
+
+class BlocksTemplate:
+    # A Block Kit structure whose strings are templates, compiled into one format string that
+    # renders straight to the JSON text the outbox stores, plus the notification text (the text
+    # of the blocks, in order). Each field is rendered once for both.
+    def __init__(self, blocks):
+        specs = []
+
+        def compile_json(value):
+            if isinstance(value, str):
+                return '"' + parse_template(value, specs, in_json=True) + '"'
+            if isinstance(value, list):
+                return '[' + ', '.join(compile_json(item) for item in value) + ']'
+            if isinstance(value, dict):
+                return '{{' + ', '.join(format_escape(json.dumps(key)) + ': ' + compile_json(item) for key, item in value.items()) + '}}'
+            return format_escape(json.dumps(value))
+        self.format = compile_json(blocks).format
+        texts = [block['text']['text'] for block in blocks
+                 if isinstance(block, dict) and isinstance(block.get('text'), dict) and isinstance(block['text'].get('text'), str)]
+        self.fallback_format = parse_template('\n'.join(texts), specs).format
+        self.fields = tuple(compile_field(spec) for spec in specs)
+
+    def render(self, record):
+        values = [field(record) for field in self.fields]
+        text = truncate_text(self.fallback_format(*values), SLACK_MAX_SECTION_CHARS)
+        return text, self.format(*[json_escape(value) for value in values])
+
+def parse_blocks(source):
+    blocks = json.loads(source)
+    if not isinstance(blocks, list) or not blocks or not all(isinstance(block, dict) and isinstance(block.get('type'), str) for block in blocks):
+        raise ValueError('Blocks must be a JSON list of objects that each have a "type".')
+    if len(blocks) > SLACK_MAX_BLOCKS:
+        raise ValueError(f"Slack accepts at most {SLACK_MAX_BLOCKS} blocks per message.")
+    return blocks
+
+# Output fields are only templated when they say so; anything else is plain text, as it always was
+TEMPLATE_PREFIX = 'template:'
+BLOCKS_PREFIX = 'blocks:'
+
+class ActionTemplate:
+    # An action's output, compiled once. action_output_field is plain text, sent verbatim in the
+    # original '<output>: <input field value>' form; 'template:' and text with {field}
+    # placeholders; or 'blocks:' and a JSON list of Block Kit blocks whose strings are templates.
+    def __init__(self, event_input_field, action_output_field):
+        self.trigger = compile_path(event_input_field)
+        self.text = self.blocks = self.label = None
+        if action_output_field.startswith(BLOCKS_PREFIX):
+            self.blocks = BlocksTemplate(parse_blocks(action_output_field[len(BLOCKS_PREFIX):]))
+        elif action_output_field.startswith(TEMPLATE_PREFIX):
+            self.text = MessageTemplate(action_output_field[len(TEMPLATE_PREFIX):])
+        else:
+            self.label = action_output_field + ': '
 
-        elif '/action-add' in self.path:
-            installation_id = self.path.split('/')[1]  
-            extension_installations_data = self.get_extension_installation_by_id(installation_id)
-            if not extension_installations_data:
-                self.send_response(404)
-                self.end_headers()
-                self.wfile.write(b"Extension Installation not found.")
-                return
-            
-            extension_installation_pk, acct_id = extension_installations_data[0], extension_installations_data[1]
-            accounts_data = self.get_account_by_id(acct_id)
-            if not accounts_data:
-                self.send_response(404)
-                self.end_headers()
-                self.wfile.write(b"Account not found.")
+    def render(self, record):
+        # Returns (text, Block Kit JSON or None), or None when the record lacks the input field
+        value = self.trigger(record)
+        if value is None:
+            return None
+        if self.blocks is not None:
+            return self.blocks.render(record)
+        if self.text is not None:
+            return self.text.render(record), None
+        return self.label + slack_escape(format_value(value)), None
+
+Action = namedtuple('Action', 'action_id action_code extension_code webhook_code event_object event_type event_input_field action_object action_type action_output_field extension_installation_pk template')
+
+class ActionIndex:
+    # Resolves webhook events to their configured actions without a query per event. Each action
+    # is keyed, for every webhook of its installation, by (extension code, webhook code, ObjectName,
+    # EventType). Every installation of an extension posts to the same /handleAsync URL, so the
+    # webhook code is what scopes an event to one installation; there is no key without it.
+    def __init__(self, pool, refresh_interval, reload_interval):
+        self.pool = pool
+        self.refresh_interval = refresh_interval
+        self.reload_interval = reload_interval
+        self.index = None
+        # action_id -> ((event_input_field, action_output_field), ActionTemplate)
+        self.templates = {}
+        # Highest action id and webhook id loaded; a refresh loads the rows past either
+        self.last_id = (0, 0)
+        self.refreshed_at = 0
+        self.reloaded_at = 0
+        self.lock = threading.Lock()
+        self.stats = {'lookups': 0, 'matches': 0, 'refreshes': 0, 'reloads': 0}
+
+    def resolve(self, extension_code, webhook_code, object_name, event_type):
+        self.refresh()
+        if event_type.startswith(EVENT_TYPE_PREFIX):
+            event_type = event_type[len(EVENT_TYPE_PREFIX):]
+        actions = self.index.get((extension_code, webhook_code, object_name, event_type), ())
+        self.stats['lookups'] += 1
+        self.stats['matches'] += len(actions)
+        return actions
+
+    def refresh(self, force=False):
+        now = time.monotonic()
+        if self.index is None and force:
+            # Nothing loaded yet; the first lookup loads everything
+            return
+        if self.index is not None and not force and now - self.refreshed_at < self.refresh_interval:
+            return
+        # Only the first load (and a forced refresh) waits; otherwise one caller refreshes while
+        # the rest keep using the current index
+        if not self.lock.acquire(blocking=self.index is None or force):
+            return
+        try:
+            reload = self.index is None or now - self.reloaded_at >= self.reload_interval
+            index, last_id = ({}, (0, 0)) if reload else (self.index, self.last_id)
+            try:
+                rows = self.load(last_id)
+            except mysql.connector.Error as err:
+                if self.index is None:
+                    raise
+                # Keep routing with what we have and try again after the next interval
+                logger.error("Action index refresh error: %s", err)
+                self.refreshed_at = now
                 return
+            # A rebuild drops the templates of deleted actions; a changed action is recompiled
+            templates = {} if reload else self.templates
+            for row in rows:
+                # One row per (action, webhook); a refresh only returns pairs it hasn't seen
+                last_id = (max(last_id[0], row[0]), max(last_id[1], row[11]))
+                template = self.compile(row, templates)
+                if template is None:
+                    continue
+                action = Action(*row[:11], template)
+                key = (action.extension_code, action.webhook_code, action.event_object, action.event_type)
+                # Readers may be using this dict: only ever replace whole tuples
+                index[key] = index.get(key, ()) + (action,)
+            self.index, self.templates, self.last_id, self.refreshed_at = index, templates, last_id, now
+            if reload:
+                self.reloaded_at = now
+            self.stats['reloads' if reload else 'refreshes'] += 1
+        finally:
+            self.lock.release()
+
+    def compile(self, row, templates):
+        action_id, source = row[0], (row[6], row[9])
+        cached = self.templates.get(action_id)
+        if cached and cached[0] == source:
+            templates[action_id] = cached
+            return cached[1]
+        try:
+            template = ActionTemplate(*source)
+        except ValueError as err:
+            logger.error("Action %s has an invalid output template: %s", action_id, err)
+            return None
+        templates[action_id] = (source, template)
+        return template
 
-            acct_name, acct_url = accounts_data[1], accounts_data[3]
-            ws_profile_data = self.get_ws_profile_by_id(extension_installation_pk)
-            if not ws_profile_data:
-                self.send_response(404)
-                self.end_headers()
-                self.wfile.write(b"Web Service Profile not found.")
-                return
+    def load(self, after):
+        # New actions with all their webhooks, plus existing actions with webhooks registered
+        # since, e.g. by a web service profile update after the action was added
+        db = self.pool.acquire()
+        try:
+            cursor = db.cursor()
+            try:
+                cursor.execute('''
+                    SELECT ea.action_id, ea.action_code, e.extension_code, w.webhook_code, ea.event_object, ea.event_type,
+                        ea.event_input_field, ea.action_object, ea.action_type, ea.action_output_field, ea.extension_installation_pk, w.id
+                    FROM ct_extension_actions ea
+                    JOIN ct_extension_installations ei ON ea.extension_installation_pk = ei.pk
+                    JOIN ct_extensions e ON ei.extension_pk = e.pk
+                    JOIN ct_webhooks w ON w.extension_installation_pk = ei.pk
+                    WHERE ea.action_id > %s OR w.id > %s
+                    ORDER BY ea.action_id
+                ''', after)
+                return cursor.fetchall()
+            finally:
+                cursor.close()
+        except mysql.connector.Error as err:
+            self.pool.failed(db, err)
+            raise
+        finally:
+            self.pool.release(db)
+
+    def size(self):
+        return len(self.index or ())
+
+action_index = ActionIndex(db_pool, ACTION_INDEX_REFRESH, ACTION_INDEX_RELOAD)
+
+InstallationPage = namedtuple('InstallationPage', 'extension_installation_pk acct_id extension_code acct_name acct_url profile_id profile_name')
+ActionRow = namedtuple('ActionRow', 'action_id action_name action_code event_object event_type event_input_field action_object action_type action_output_field')
+
+ROUTE_PARAM_RE = re.compile(r'<(?:(\w+):)?(\w+)>')
+
+def int_param(value):
+    # int() alone would also accept '+1', ' 1' and '1_000'
+    if not (value.isascii() and value.isdigit()):
+        raise ValueError(value)
+    return int(value)
+
+# 'path' is special: it must be the last segment and captures the rest of the path
+ROUTE_CONVERTERS = {'str': str, 'int': int_param, 'path': str}
+
+class Router:
+    # Routes compile into a trie keyed by path segment. Static segments are a dict lookup and win
+    # over parameters, so dispatch walks the path once whatever the number or order of routes.
+    def __init__(self, routes):
+        self.root = self.new_node()
+        # Routes without parameters also go in a flat dict, so most requests skip the trie entirely
+        self.static = {}
+        for method, pattern, handler in routes:
+            self.add(method, pattern, handler)
+
+    def new_node(self):
+        return {'static': {}, 'params': {}, 'rest': None, 'routes': {}}
+
+    def split(self, path):
+        # Empty segments are dropped, so '/accounts' and '/accounts/' are the same route
+        return [segment for segment in path.split('/') if segment]
+
+    def add(self, method, pattern, handler):
+        node, names, segments = self.root, [], self.split(pattern)
+        for index, segment in enumerate(segments):
+            match = ROUTE_PARAM_RE.fullmatch(segment)
+            if not match:
+                node = node['static'].setdefault(segment, self.new_node())
+                continue
+            converter, name = match.group(1) or 'str', match.group(2)
+            if converter not in ROUTE_CONVERTERS:
+                raise ValueError(f"Unknown converter '{converter}' in route {pattern}")
+            names.append(name)
+            if converter == 'path':
+                if index != len(segments) - 1:
+                    raise ValueError(f"A path parameter must come last in route {pattern}")
+                node['rest'] = node['rest'] or self.new_node()
+                node = node['rest']
+            else:
+                node = node['params'].setdefault(converter, self.new_node())
+        if method in node['routes']:
+            raise ValueError(f"Duplicate route {method} {pattern}")
+        node['routes'][method] = (handler, names)
+        if not names:
+            self.static[(method, '/' + '/'.join(segments))] = (handler, {})
+
+    def match(self, method, path):
+        # Returns (handler, params) or None
+        route = self.static.get((method, path.rstrip('/') or '/'))
+        if route:
+            return route
+        return self.walk(self.root, self.split(path), 0, [], method)
+
+    def walk(self, node, segments, index, values, method):
+        if index == len(segments):
+            route = node['routes'].get(method)
+            return (route[0], dict(zip(route[1], values))) if route else None
+
+        segment = segments[index]
+        child = node['static'].get(segment)
+        if child is not None:
+            found = self.walk(child, segments, index + 1, values, method)
+            if found:
+                return found
+
+        # Only backtracks into parameters when the static branch had no route for the rest
+        value = urllib.parse.unquote(segment) if '%' in segment else segment
+        for converter, child in node['params'].items():
+            try:
+                converted = ROUTE_CONVERTERS[converter](value)
+            except ValueError:
+                continue
+            found = self.walk(child, segments, index + 1, values + [converted], method)
+            if found:
+                return found
+
+        if node['rest'] is not None:
+            route = node['rest']['routes'].get(method)
+            if route:
+                rest = urllib.parse.unquote('/'.join(segments[index:]))
+                return route[0], dict(zip(route[1], values + [rest]))
+        return None
+
+ROUTES = [
+    ('GET', '/', 'show_index'),
+    ('GET', '/assets/<path:asset_path>', 'send_asset'),
+    ('GET', '/extensions', 'show_extensions'),
+    ('GET', '/extension-add', 'show_extension_add'),
+    ('GET', '/accounts', 'show_accounts'),
+    ('GET', '/accounts/<int:acct_id>', 'show_account'),
+    ('GET', '/account-add', 'show_account_add'),
+    ('GET', '/metrics', 'show_metrics'),
+    ('GET', '/callback/<extension_code>', 'oauth_callback'),
+    ('GET', '/<extension_code>/install', 'install_extension'),
+    ('GET', '/<installation_id>/actions', 'show_actions'),
+    ('GET', '/<installation_id>/action-add', 'show_action_add'),
+    ('GET', '/<installation_id>/ws-profile', 'show_ws_profile'),
+    ('POST', '/submit_extension', 'post_extension'),
+    ('POST', '/submit_account', 'post_account'),
+    ('POST', '/update_ws_profile', 'post_ws_profile'),
+    ('POST', '/submit_action', 'post_action'),
+    ('POST', '/<extension_code>/handleAsync', 'handle_async'),
+]
+
+router = Router(ROUTES)
 
-            profile_id = ws_profile_data[0]
-            self.send_html_response('templates/action-add.html', {
-                "{{ acct_id }}": f"{acct_id}",
-                "{{ account_name }}": acct_name,
-                "{{ installation_id }}": f"{installation_id}",
-                "{{ extension_installation_pk }}": f"{extension_installation_pk}",
-                "{{ profile_id }}": f"{profile_id}"
-            })
+class MyHandler(http.server.SimpleHTTPRequestHandler):
+    # Persistent connections; every response below is framed by Content-Length or chunked encoding
+    protocol_version = 'HTTP/1.1'
+    # An idle keep-alive connection holds a worker, so drop it after a short read timeout
+    timeout = KEEPALIVE_TIMEOUT
+    # Headers and body go out as separate writes; with Nagle on, a reused connection waits
+    # for the client's delayed ACK (~40ms) before the body is sent
+    disable_nagle_algorithm = True
+
+    def handle_one_request(self):
+        self.response_started = False
+        self.status_code = 0
+        super().handle_one_request()
+
+    def send_response(self, code, message=None):
+        self.response_started = True
+        self.status_code = code
+        super().send_response(code, message)
+        trace = getattr(request_context, 'trace', None)
+        if trace is not None:
+            self.send_header('X-Request-ID', trace.request_id)
+        if self.server.saturated.is_set():
+            self.send_header('Connection', 'close')
+
+    def accepted_encodings(self):
+        accepted = set()
+        for coding in self.headers.get('Accept-Encoding', '').split(','):
+            name, _, params = coding.partition(';')
+            q = params.strip()
+            try:
+                weight = float(q[2:]) if q.startswith('q=') else 1.0
+            except ValueError:
+                weight = 0
+            if weight > 0:
+                accepted.add(name.strip().lower())
+        return accepted
+
+    def response_encoding(self, content_type, size=None):
+        if not content_type.startswith(('text/html', 'application/json')):
+            return None
+        if size is not None and size < COMPRESS_MIN_SIZE:
+            return None
+        accepted = self.accepted_encodings()
+        return next((coding for coding in ('gzip', 'deflate') if coding in accepted), None)
 
-        elif '/ws-profile/' in self.path:
-            installation_id = self.path.split('/')[1]  
-            extension_installations_data = self.get_extension_installation_by_id(installation_id)
-            if not extension_installations_data:
-                self.send_response(404)
-                self.end_headers()
-                self.wfile.write(b"Extension Installation not found.")
-                return
-            
-            extension_installation_pk, acct_id, extension_code = extension_installations_data[0], extension_installations_data[1], extension_installations_data[2]
-            accounts_data = self.get_account_by_id(acct_id)
-            if not accounts_data:
-                self.send_response(404)
-                self.end_headers()
-                self.wfile.write(b"Account not found.")
-                return
+    def compressor(self, encoding):
+        # wbits 31 writes a gzip wrapper, 15 the zlib stream that HTTP calls "deflate"
+        return zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED, 31 if encoding == 'gzip' else 15)
 
-            acct_name, acct_url = accounts_data[1], accounts_data[3]
+    def send_body(self, code, body, content_type='text/plain; charset=utf-8', headers=None):
+        # Helpers that already answered the request (e.g. with a 500) leave the caller's response unsent
+        if self.response_started:
+            return
+        encoding = self.response_encoding(content_type, len(body))
+        if encoding:
+            compressor = self.compressor(encoding)
+            body = compressor.compress(body) + compressor.flush()
+        self.send_response(code)
+        self.send_header('Content-type', content_type)
+        if content_type.startswith(('text/html', 'application/json')):
+            self.send_header('Vary', 'Accept-Encoding')
+        if encoding:
+            self.send_header('Content-Encoding', encoding)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_text(self, code, body):
+        self.send_body(code, body)
 
-            ws_profile_data = self.get_ws_profile_by_id(extension_installation_pk)
-            if not ws_profile_data:
-                self.send_response(404)
+    def send_json(self, code, data):
+        self.send_body(code, json.dumps(data).encode(), 'application/json')
+
+    def send_redirect(self, code, location):
+        self.send_body(code, b"", headers={'Location': location})
+
+    def send_html_response(self, template_path, replacements=None):
+        start = time.perf_counter()
+        try:
+            body = template_cache.render(template_path, replacements)
+        except FileNotFoundError:
+            self.send_text(500, b"Error: Template file not found.")
+            return
+        trace_span('render', template_path, start, time.perf_counter() - start)
+        self.send_body(200, body, 'text/html')
+
+    def send_asset(self, asset_path):
+        entry, fingerprinted = asset_manifest.lookup('/assets/' + asset_path)
+        if entry is None:
+            self.send_text(404, b"File not found.")
+            return
+
+        cache_control = f'public, max-age={ASSET_MAX_AGE}, immutable' if fingerprinted else 'no-cache'
+        accepted = self.accepted_encodings()
+        encoding = next((coding for coding in ('br', 'gzip') if coding in accepted and coding in entry['variants']), None)
+        etag = entry['etag'] if encoding is None else f'"{entry["hash"]}-{encoding}"'
+
+        if_none_match = self.headers.get('If-None-Match')
+        if if_none_match:
+            tags = {tag.strip().removeprefix('W/') for tag in if_none_match.split(',')}
+            if '*' in tags or etag in tags:
+                self.send_response(304)
+                self.send_header('ETag', etag)
+                self.send_header('Cache-Control', cache_control)
                 self.end_headers()
-                self.wfile.write(b"Web Service Profile not found.")
                 return
 
-            profile_id, profile_name = ws_profile_data[0], ws_profile_data[2]
+        self.send_response(200)
+        self.send_header('Content-type', entry['content_type'])
+        self.send_header('ETag', etag)
+        self.send_header('Cache-Control', cache_control)
+        if entry['variants']:
+            self.send_header('Vary', 'Accept-Encoding')
+        if encoding:
+            body = entry['variants'][encoding]
+            self.send_header('Content-Encoding', encoding)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
 
-            self.send_html_response('templates/ws-profile.html', {
-                "{{ acct_id }}": f"{acct_id}",
-                "{{ account_name }}": f"{acct_name}",
-                "{{ profile_name }}": f"{profile_name}",
-                "{{ profile_id }}": f"{profile_id}",
-                "{{ extension_code }}": f"{extension_code}",
-                "{{ extension_installation_pk }}": f"{extension_installation_pk}"
-            })
+        self.send_header('Content-Length', str(entry['size']))
+        self.end_headers()
+        with open(entry['path'], 'rb') as file:
+            # socket.sendfile uses os.sendfile, so the file never passes through user space
+            self.connection.sendfile(file)
 
+    def send_html_stream(self, template_path, replacements=None):
+        try:
+            template_cache.get(template_path)
+        except FileNotFoundError:
+            self.send_text(500, b"Error: Template file not found.")
+            return
+        if self.response_started:
+            return
+        # Streamed pages have no length up front, so compress whenever the client accepts it
+        encoding = self.response_encoding('text/html')
+        compressor = self.compressor(encoding) if encoding else None
+        self.send_response(200)
+        self.send_header('Content-type', 'text/html')
+        self.send_header('Vary', 'Accept-Encoding')
+        if encoding:
+            self.send_header('Content-Encoding', encoding)
+        chunked = self.request_version >= 'HTTP/1.1'
+        if chunked:
+            self.send_header('Transfer-Encoding', 'chunked')
         else:
-            self.send_response(404)
-            self.end_headers()
+            # Without chunked encoding the end of the body is signalled by closing the connection
+            self.send_header('Connection', 'close')
+        self.end_headers()
+
+        # Rows are fetched while the page renders, so the render span excludes the DB time it overlaps
+        trace = getattr(request_context, 'trace', None)
+        db_before, start = trace.totals.get('db', 0) if trace else 0, time.perf_counter()
+        buffer, size = [], 0
+        for part in template_cache.iter_render(template_path, replacements):
+            buffer.append(part)
+            size += len(part)
+            if size >= STREAM_CHUNK_SIZE:
+                self.write_chunk(b"".join(buffer), chunked, compressor)
+                buffer, size = [], 0
+        self.write_chunk(b"".join(buffer), chunked, compressor, final=True)
+        if chunked:
+            self.wfile.write(b"0\r\n\r\n")
+        if trace:
+            trace.add('render', template_path, start, time.perf_counter() - start - (trace.totals.get('db', 0) - db_before))
+
+    def write_chunk(self, data, chunked, compressor=None, final=False):
+        if compressor:
+            # A sync flush per chunk lets the browser start rendering before the page is finished
+            data = compressor.compress(data) + compressor.flush(zlib.Z_FINISH if final else zlib.Z_SYNC_FLUSH)
+        if not data:
+            return
+        if chunked:
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+        else:
+            self.wfile.write(data)
+
+    def page_params(self):
+        params = urllib.parse.parse_qs(urllib.parse.urlparse(self.path).query)
+        try:
+            after = int(params.get('after', [0])[0])
+        except ValueError:
+            after = 0
+        try:
+            limit = min(max(int(params.get('limit', [PAGE_SIZE])[0]), 1), PAGE_SIZE_MAX)
+        except ValueError:
+            limit = PAGE_SIZE
+        return {'after': after, 'limit': limit, 'q': params.get('q', [''])[0].strip()}
+
+    def stream_page_rows(self, rows, paging, render_row, empty_html, page):
+        # Rows are fetched with LIMIT limit + 1; the extra row only tells us a next page exists
+        count = 0
+        try:
+            for row in rows:
+                if count == paging['limit']:
+                    page['more'] = True
+                    break
+                count += 1
+                page['last'] = row[0]
+                yield render_row(row)
+        finally:
+            rows.close()
+        if count == 0:
+            yield empty_html
+
+    def pagination_html(self, paging, page):
+        path = urllib.parse.urlparse(self.path).path
+        filters = {'q': paging['q']} if paging['q'] else {}
+        links = []
+        if paging['after']:
+            first_query = urllib.parse.urlencode(dict(filters, limit=paging['limit']))
+            links.append(f"<a class='btn btn-outline-secondary btn-sm' href='{path}?{first_query}'>First page</a>")
+        if page.get('more'):
+            next_query = urllib.parse.urlencode(dict(filters, after=page['last'], limit=paging['limit']))
+            links.append(f"<a class='btn btn-outline-secondary btn-sm' href='{path}?{next_query}'>Next page</a>")
+        if links:
+            yield "<div class='d-flex justify-content-end gap-2'>" + "".join(links) + "</div>"
+
+    def do_GET(self):
+        self.dispatch('GET')
 
     def do_POST(self):
-        if self.path == '/submit_extension':
-            content_length = int(self.headers['Content-Length'])
-            post_data = self.rfile.read(content_length)
-            self.submit_extension(post_data)
-            self.send_response(303)
-            self.send_header('Location', '/extensions')
-            self.end_headers()
+        self.dispatch('POST')
+
+    def dispatch(self, method):
+        route = router.match(method, self.path.partition('?')[0])
+        handler, params = route or ('not_found', {})
+        labels = (('route', handler), ('method', method))
+        request_id = self.headers.get('X-Request-ID', '')
+        trace = request_context.trace = RequestTrace(request_id if REQUEST_ID_RE.match(request_id) else uuid.uuid4().hex)
+        metrics.inc('app_http_requests_in_flight')
+        try:
+            if route is None:
+                # An unread request body would be parsed as the next request, so don't keep the connection
+                self.send_body(404, b"Not found.", headers={'Connection': 'close'} if method == 'POST' else None)
+            else:
+                getattr(self, handler)(**params)
+        except Exception:
+            logger.exception("Unhandled error in %s", handler)
+            # Once a response has started the client can't be told; closing ends the broken body
+            self.close_connection = True
+            self.send_body(500, b"Internal server error.", headers={'Connection': 'close'})
+            self.status_code = 500
+        finally:
+            duration = time.perf_counter() - trace.start
+            metrics.inc('app_http_requests_in_flight', amount=-1)
+            metrics.observe('app_http_request_duration_seconds', labels, duration)
+            metrics.inc('app_http_requests_total', labels + (('status', str(self.status_code)),))
+            if self.status_code >= 500:
+                metrics.inc('app_http_request_errors_total', labels)
+            self.log_request_trace(trace, handler, method, duration)
+            request_context.trace = None
+
+    def log_request_trace(self, trace, route, method, duration):
+        slow = duration * 1000 >= LOG_SLOW_REQUEST_MS
+        level = logging.ERROR if self.status_code >= 500 else logging.WARNING if slow else logging.INFO
+        if not logger.isEnabledFor(level):
+            return
+        rate = LOG_SAMPLE_RATES.get(route, LOG_SAMPLE_RATE)
+        if level == logging.INFO and rate < 1 and random.random() >= rate:
+            return
 
-        elif self.path == '/submit_account':
-            content_length = int(self.headers['Content-Length'])
-            post_data = self.rfile.read(content_length)
-            self.submit_account(post_data)
-            self.send_response(303)
-            self.send_header('Location', '/accounts')
-            self.end_headers()
+        # The query string is left out: it can carry OAuth codes and account URLs
+        fields = {
+            'method': method,
+            'path': self.path.partition('?')[0],
+            'route': route,
+            'status': self.status_code,
+            'client': self.client_address[0],
+            'duration_ms': round(duration * 1000, 2),
+        }
+        for kind, total in trace.totals.items():
+            fields[f'{kind}_ms'] = round(total * 1000, 2)
+            fields[f'{kind}_calls'] = trace.counts[kind]
+        if slow:
+            fields['spans'] = [{'kind': kind, 'name': name, 'start_ms': round(start * 1000, 2), 'duration_ms': round(span * 1000, 2)}
+                               for kind, name, start, span in trace.spans]
+        logger.log(level, "Slow request" if slow else "Request", extra={'fields': fields})
+
+    def log_request(self, code='-', size='-'):
+        # dispatch writes the structured request log instead of the access log line
+        pass
+
+    def log_message(self, format, *args):
+        logger.warning("%s - " + format, self.address_string(), *args)
+
+    def show_metrics(self):
+        pool, cache = db_pool.metrics(), lookup_cache.metrics()
+        samples = [('app_db_pool_connections', (('state', state),), pool[state]) for state in ('size', 'open', 'idle', 'in_use')]
+        samples += [('app_db_pool_events_total', (('event', event),), pool[event]) for event in db_pool.stats]
+        samples += [('app_lookup_cache_entries', (), cache['size'])]
+        samples += [('app_lookup_cache_events_total', (('event', event),), cache[event]) for event in lookup_cache.stats]
+        samples += [('app_oauth_token_events_total', (('event', event),), count) for event, count in oauth_tokens.stats.items()]
+        samples += [('app_slack_queue_depth', (), slack_outbox.scheduler.depth)]
+        samples += [('app_slack_throttle_seconds_total', (('reason', reason),), seconds) for reason, seconds in slack_outbox.scheduler.stats.items()]
+        samples += [('app_slack_rate_limited_total', (), slack_outbox.scheduler.rate_limited)]
+        tokens = slack_tokens.cache.metrics()
+        samples += [('app_slack_token_entries', (), tokens['size'])]
+        samples += [('app_oauth_state_events_total', (('event', event),), count) for event, count in pending_installs.stats.items()]
+        samples += [('app_slack_token_events_total', (('event', event),), tokens[event]) for event in slack_tokens.cache.stats]
+        samples += [('app_action_index_entries', (), action_index.size())]
+        samples += [('app_action_index_events_total', (('event', event),), count) for event, count in action_index.stats.items()]
+        samples += [('app_webhook_dedupe_events_total', (('event', event),), count) for event, count in webhook_deliveries.stats.items()]
+        for host, stats in http_client.metrics().items():
+            samples.append(('app_outbound_connections_total', (('host', host), ('connection', 'new')), stats['new_connections']))
+            samples.append(('app_outbound_connections_total', (('host', host), ('connection', 'reused')), stats['reused_connections']))
+        self.send_body(200, metrics.render(samples).encode(), 'text/plain; version=0.0.4; charset=utf-8')
+
+    def show_index(self):
+        self.send_html_response('templates/index.html')
+
+    def show_extensions(self):
+        paging, page = self.page_params(), {}
+        extensions_data = self.get_extensions(paging['after'], paging['limit'] + 1, paging['q'])
+        if extensions_data is None:
+            return
+        extensions_html = self.stream_page_rows(
+            extensions_data, paging,
+            lambda extension: f"<tr><td>{extension[2]}</td><td>{extension[3]}</td><td>{extension[4]}</td><td>{extension[5]}</td><td>{extension[8]}</td></tr>",
+            "<tr><td colspan='12'>No extensions found.</td></tr>", page)
+        try:
+            self.send_html_stream('templates/extensions.html', {
+                "{{ extensions }}": extensions_html,
+                "{{ q }}": html.escape(paging['q']),
+                "{{ pagination }}": self.pagination_html(paging, page)
+            })
+        finally:
+            extensions_data.close()
 
-        elif self.path == '/update_ws_profile':
-            content_length = int(self.headers['Content-Length'])
-            post_data = self.rfile.read(content_length)
-            
-            parsed_data = urllib.parse.parse_qs(post_data.decode('utf-8'))
-            acct_id = parsed_data.get('acct_id', [None])[0]
+    def show_extension_add(self):
+        self.send_html_response('templates/extension-add.html')
 
-            self.update_ws_profile(post_data)
+    def show_account(self, acct_id):
+        accounts_data = self.get_account_by_id(acct_id)
+        if not accounts_data:
+            self.send_text(404, b"Account not found.")
+            return
 
-            # Construct the Location header with acct_id if it exists
-            location = '/accounts/'
-            if acct_id:
-                location += f'{urllib.parse.quote(acct_id)}'
-            
-            self.send_response(303)
-            self.send_header('Location', location)
-            self.end_headers()
+        acct_name, acct_url = accounts_data[1], accounts_data[3]
+        installed_rows, available_rows = [], []
+        for extension in self.get_extension_catalog(acct_id):
+            if extension[4] is None:
+                available_rows.append(f"<tr><td>{extension[0]}</td><td>{extension[1]}</td><td><a href='/{extension[5]}/install?account_url={acct_url}'>Install</a></td></tr>")
+            elif extension[6] is not None:
+                installed_rows.append(f"<tr><td>{extension[0]}</td><td>{extension[1]}</td><td>{self.get_extension_link(extension)}</td></tr>")
+        installed_extensions_html = "".join(installed_rows) or "<tr><td colspan='4'>No extensions are installed yet.</td></tr>"
+        available_extensions_html = "".join(available_rows) or "<tr><td colspan='4'>No available extensions.</td></tr>"
+
+        self.send_html_response('templates/account-extensions.html', {
+            "{{ account_name }}": acct_name,
+            "{{ installed_extensions }}": installed_extensions_html,
+            "{{ available_extensions }}": available_extensions_html,
+        })
+
+    def show_accounts(self):
+        paging, page = self.page_params(), {}
+        accounts_data = self.get_accounts(paging['after'], paging['limit'] + 1, paging['q'])
+        if accounts_data is None:
+            return
+        accounts_html = self.stream_page_rows(
+            accounts_data, paging,
+            lambda account: f"<tr><td>{account[1]}</td><td>{account[2]}</td><td>{account[3]}</td><td>{'Active' if account[4] == 0 else 'Inactive'}</td><td><a href='/accounts/{account[0]}'>View Installed Extensions</a></td></tr>",
+            "<tr><td colspan='12'>No accounts found.</td></tr>", page)
+        try:
+            self.send_html_stream('templates/accounts.html', {
+                "{{ accounts }}": accounts_html,
+                "{{ q }}": html.escape(paging['q']),
+                "{{ pagination }}": self.pagination_html(paging, page)
+            })
+        finally:
+            accounts_data.close()
 
-        elif self.path == '/submit_action':
-            content_length = int(self.headers['Content-Length'])
-            post_data = self.rfile.read(content_length)
+    def show_account_add(self):
+        self.send_html_response('templates/account-add.html')
 
-            parsed_data = urllib.parse.parse_qs(post_data.decode('utf-8'))
-            installation_id = parsed_data.get('installation_id', [None])[0]
+    def install_extension(self, extension_code):
+        # Parse the query parameters
+        query = urllib.parse.urlparse(self.path).query
+        params = urllib.parse.parse_qs(query)
+        if not 'account_url' in params:
+            self.send_text(400, b"Missing account_url.")
+            return
 
-            self.submit_action(post_data)
+        self.handle_installation(extension_code, params['account_url'][0])  # Pass the first account_url
 
-            # Construct the Location header with acct_id if it exists
-            location = '/'
-            if installation_id:
-                location += f'{urllib.parse.quote(installation_id)}' +'/actions'
+    def oauth_callback(self, extension_code):
+        extensions_data = self.get_extension_by_code(extension_code)
+        if not extensions_data:
+            self.send_text(404, b"Extension not found.")
+            return
 
-            self.send_response(303)
-            self.send_header('Location', location)
-            self.end_headers()
+        self.handle_callback(extension_code)
 
-        elif '/handleAsync' in self.path:
-            content_length = int(self.headers['Content-Length'])
-            
-            # Check if content length is zero
-            if content_length == 0:
-                self.send_response(400)
-                self.send_header('Content-Type', 'application/json')
-                self.end_headers()
-                self.wfile.write(json.dumps({"error": "No data provided."}).encode())
+    def show_actions(self, installation_id):
+        paging = self.page_params()
+        page, first, rows = self.load_actions_page(installation_id, paging['after'], paging['limit'] + 1, paging['q'])
+        if not page:
+            self.send_text(404, b"Extension Installation not found.")
+            return
+
+        try:
+            if page.acct_name is None:
+                self.send_text(404, b"Account not found.")
                 return
 
-            post_data = self.rfile.read(content_length)
+            links = {}
+            actions_html = self.stream_page_rows(
+                self.iter_action_rows(first, rows), paging,
+                lambda action: f"<tr><td>{action.action_name}</td><td>{action.event_object}</td><td>{action.event_type}</td><td>{action.action_object}</td><td>{action.action_type}</td><td>{action.action_code}</td></tr>",
+                "<tr><td colspan='12'>No extension actions found.</td></tr>", links)
+            self.send_html_stream('templates/actions.html', {
+                "{{ actions }}": actions_html,
+                "{{ acct_id }}": f"{page.acct_id}",
+                "{{ account_name }}": page.acct_name,
+                "{{ installation_id }}": f"{installation_id}",
+                "{{ q }}": html.escape(paging['q']),
+                "{{ pagination }}": self.pagination_html(paging, links)
+            })
+        finally:
+            rows.close()
 
-            extension_code = self.path.split('/')[-2]  
-            extensions_data = self.get_extension_by_code(extension_code)
-            if not extensions_data:
-                self.send_response(404)
-                self.end_headers()
-                self.wfile.write(b"Extension not found.")
-                return
+    def show_action_add(self, installation_id):
+        page = self.load_installation_page(installation_id)
+        if not self.check_installation_page(page):
+            return
+
+        self.send_html_response('templates/action-add.html', {
+            "{{ acct_id }}": f"{page.acct_id}",
+            "{{ account_name }}": page.acct_name,
+            "{{ installation_id }}": f"{installation_id}",
+            "{{ extension_installation_pk }}": f"{page.extension_installation_pk}",
+            "{{ profile_id }}": f"{page.profile_id}"
+        })
+
+    def show_ws_profile(self, installation_id):
+        page = self.load_installation_page(installation_id)
+        if not self.check_installation_page(page):
+            return
+
+        self.send_html_response('templates/ws-profile.html', {
+            "{{ acct_id }}": f"{page.acct_id}",
+            "{{ account_name }}": f"{page.acct_name}",
+            "{{ profile_name }}": f"{page.profile_name}",
+            "{{ profile_id }}": f"{page.profile_id}",
+            "{{ extension_code }}": f"{page.extension_code}",
+            "{{ extension_installation_pk }}": f"{page.extension_installation_pk}"
+        })
+
+    def post_extension(self):
+        content_length = int(self.headers['Content-Length'])
+        post_data = self.rfile.read(content_length)
+        self.submit_extension(post_data)
+        self.send_redirect(303, '/extensions')
+
+    def post_account(self):
+        content_length = int(self.headers['Content-Length'])
+        post_data = self.rfile.read(content_length)
+        self.submit_account(post_data)
+        self.send_redirect(303, '/accounts')
+
+    def post_ws_profile(self):
+        content_length = int(self.headers['Content-Length'])
+        post_data = self.rfile.read(content_length)
+        
+        parsed_data = urllib.parse.parse_qs(post_data.decode('utf-8'))
+        acct_id = parsed_data.get('acct_id', [None])[0]
+
+        self.update_ws_profile(post_data)
+        # Actions already on the installation start routing the new webhook's events here at once
+        action_index.refresh(force=True)
+
+        # Construct the Location header with acct_id if it exists
+        location = '/accounts/'
+        if acct_id:
+            location += f'{urllib.parse.quote(acct_id)}'
+        
+        self.send_redirect(303, location)
+
+    def post_action(self):
+        content_length = int(self.headers['Content-Length'])
+        post_data = self.rfile.read(content_length)
+
+        parsed_data = urllib.parse.parse_qs(post_data.decode('utf-8'))
+        installation_id = parsed_data.get('installation_id', [None])[0]
+
+        self.submit_action(post_data)
+        # The new action is routed here at once; other workers pick it up on their next refresh
+        action_index.refresh(force=True)
+
+        # Construct the Location header with acct_id if it exists
+        location = '/'
+        if installation_id:
+            location += f'{urllib.parse.quote(installation_id)}' +'/actions'
 
-            # Print received data for debugging
-            print(f"Received post_data: {post_data.decode('utf-8')}")
+        self.send_redirect(303, location)
 
-            # Try to load JSON
+    def handle_async(self, extension_code):
+        content_length = int(self.headers['Content-Length'])
+        
+        # Check if content length is zero
+        if content_length == 0:
+            self.send_json(400, {"error": "No data provided."})
+            return
+
+        post_data = self.rfile.read(content_length)
+
+        # Upstream retries are answered from the dedupe store before any parsing or DB work
+        delivery_key = (extension_code, self.delivery_id(post_data))
+        try:
+            state = webhook_deliveries.claim(delivery_key)
+        except mysql.connector.Error as err:
+            logger.error("Delivery dedupe error: %s", err)
+            self.send_json(503, {"error": "Failed to queue message for Slack."})
+            return
+        if state == 'done':
+            self.send_json(202, {"message": "Duplicate delivery ignored."})
+            return
+        if state == 'pending':
+            self.send_body(409, json.dumps({"error": "Delivery is already being processed."}).encode(),
+                           'application/json', headers={'Retry-After': '1'})
+            return
+
+        # The outcome is recorded before responding, so a retry sent as soon as we answer sees it
+        status, body = 503, {"error": "Failed to queue message for Slack."}
+        try:
+            status, body = self.queue_webhook_message(extension_code, post_data)
+        finally:
             try:
-                payload = json.loads(post_data)
-            except json.JSONDecodeError:
-                self.send_response(400)
-                self.send_header('Content-Type', 'application/json')
-                self.end_headers()
-                self.wfile.write(json.dumps({"error": "Invalid JSON format."}).encode())
-                return
+                webhook_deliveries.finish(delivery_key, status == 202)
+            except mysql.connector.Error as err:
+                logger.error("Delivery dedupe error: %s", err)
+        self.send_json(status, body)
+
+    def delivery_id(self, post_data):
+        for header in DEDUPE_HEADERS:
+            value = self.headers.get(header)
+            if value:
+                return 'id:' + value.strip()[:200]
+        return 'sha256:' + hashlib.sha256(post_data).hexdigest()
+
+    def queue_webhook_message(self, extension_code, post_data):
+        # Returns the (status, JSON body) to answer with
+        extensions_data = self.get_extension_by_code(extension_code)
+        if not extensions_data:
+            return 404, {"error": "Extension not found."}
 
-            channel = payload.get('channel')
-            message = payload.get('message')
+        # Try to load JSON
+        try:
+            payload = json.loads(post_data)
+        except json.JSONDecodeError:
+            return 400, {"error": "Invalid JSON format."}
 
-            # Replace with your actual Slack bot token
-            token = SLACK_TOKEN
+        if not isinstance(payload, dict):
+            return 400, {"error": "Invalid JSON format."}
+        if payload.get('ObjectName') and payload.get('EventType'):
+            return self.queue_action_messages(extension_code, payload)
 
-            # Send message to Slack
-            slack_response = self.send_message_to_slack(channel, message, token)
+        channel = payload.get('channel')
+        message = payload.get('message')
+        if not channel or not message:
+            return 400, {"error": "Both channel and message are required."}
 
-            # Check response from Slack
-            if slack_response.get('ok'):
-                self.send_response(200)
-                self.send_header('Content-Type', 'application/json')
-                self.end_headers()
-                self.wfile.write(json.dumps({"message": "Message sent to Slack."}).encode())
-            else:
-                self.send_response(500)
-                self.send_header('Content-Type', 'application/json')
-                self.end_headers()
-                self.wfile.write(json.dumps({"error": f"Failed to send message to Slack: {slack_response.get('error')}"}).encode())
+        # Persist to the outbox; background workers deliver to Slack with retries
+        try:
+            slack_outbox.enqueue(extension_code, channel, message)
+        except Exception as err:
+            logger.error("Outbox enqueue error: %s", err)
+            return 503, {"error": "Failed to queue message for Slack."}
+
+        return 202, {"message": "Message queued for Slack."}
+
+    def queue_action_messages(self, extension_code, payload):
+        # A record event fans out to the actions configured for its object and event type, on the
+        # installation whose webhook sent it
+        for name in ('ObjectName', 'EventType', 'WebhookId'):
+            if not isinstance(payload.get(name), (str, type(None))):
+                return 400, {"error": f"{name} must be a string."}
+        if not payload.get('WebhookId'):
+            return 400, {"error": "WebhookId is required for record events."}
+        record = payload.get('Record', payload)
+        if not isinstance(record, dict):
+            return 400, {"error": "Record must be a JSON object."}
+
+        try:
+            actions = action_index.resolve(extension_code, payload['WebhookId'], payload['ObjectName'], payload['EventType'])
+        except mysql.connector.Error as err:
+            logger.error("Action index error: %s", err)
+            return 503, {"error": "Failed to queue message for Slack."}
+        messages = []
+        for action in actions:
+            channel = action.action_object or payload.get('channel')
+            rendered = action.template.render(record) if channel else None
+            if rendered:
+                messages.append((channel,) + rendered + (action.extension_installation_pk,))
+        if not messages:
+            # Not an error: the source would only retry an event nobody subscribed to
+            return 202, {"message": "No actions matched the event."}
+
+        try:
+            slack_outbox.enqueue_many(extension_code, messages)
+        except Exception as err:
+            logger.error("Outbox enqueue error: %s", err)
+            return 503, {"error": "Failed to queue message for Slack."}
 
+        return 202, {"message": f"{len(messages)} action message(s) queued for Slack."}
 
     def connect_db(self):
+        start = time.perf_counter()
         try:
-            return mysql.connector.connect(
-                host=os.getenv('MYSQL_HOST'),
-                user=os.getenv('MYSQL_USER'),
-                password=os.getenv('MYSQL_PASSWORD'),
-                database=os.getenv('MYSQL_DB')
-            )
+            return db_pool.acquire()
         except mysql.connector.Error as err:
-            print(f"Error: {err}")
+            logger.error("Database connection error: %s", err)
             return None
+        finally:
+            trace_span('db_pool', 'acquire', start, time.perf_counter() - start)
+
+    def release_db(self, db):
+        db_pool.release(db)
 
-    def execute_db_query(self, query, params=None):
+    def execute_db_query(self, name, query, params=None):
+        # Queries are timed under the name passed by the caller, e.g. load_account_by_id
+        labels = (('query', name),)
         db = self.connect_db()
         if not db:
-            self.send_response(500)
-            self.end_headers()
-            self.wfile.write(b"Database connection failed.")
+            self.send_text(500, b"Database connection failed.")
             return
+        start = time.perf_counter()
         try:
             cursor = db.cursor()
             cursor.execute(query, params or ())
             return cursor.fetchall()
         except mysql.connector.Error as err:
-            print(f"Database error: {err}")
-            return []
+            db_pool.failed(db, err)
+            metrics.inc('app_db_query_errors_total', labels)
+            logger.error("Database error: %s", err)
+            return None
         finally:
+            duration = time.perf_counter() - start
+            metrics.observe('app_db_query_duration_seconds', labels, duration)
+            trace_span('db', labels[0][1], start, duration)
             cursor.close()
-            db.close()
+            self.release_db(db)
     
+    def iter_db_query(self, name, query, params=None):
+        # Connects and executes before returning, so a failure can still be answered with a 500
+        # before a streaming page sends its headers; only the fetches are streamed. Returns None
+        # once the 500 has been sent.
+        labels = (('query', name),)
+        db = self.connect_db()
+        if not db:
+            self.send_text(500, b"Database connection failed.")
+            return None
+        cursor = db.cursor()
+        start = time.perf_counter()
+        try:
+            cursor.execute(query, params or ())
+        except mysql.connector.Error as err:
+            db_pool.failed(db, err)
+            metrics.inc('app_db_query_errors_total', labels)
+            logger.error("Database error: %s", err)
+            RowStream(db, cursor, labels, start, time.perf_counter() - start).close()
+            self.send_text(500, b"Database error occurred.")
+            return None
+        return RowStream(db, cursor, labels, start, time.perf_counter() - start)
+
     def generate_random_code(self, length=6):
         characters = 'abcdefghijklmnopqrstuvwxyz0123456789'  # lowercase letters and numbers
         return ''.join(random.choice(characters) for _ in range(length))
 
-    def get_extensions(self):
-        return self.execute_db_query('SELECT pk, extension_code, extension_name, description, authorization_url, token_url, client_id, client_secret, scope FROM ct_extensions')
+    def get_extensions(self, after=0, limit=PAGE_SIZE, search=''):
+        if search:
+            return self.iter_db_query('get_extensions', 'SELECT pk, extension_code, extension_name, description, authorization_url, token_url, client_id, client_secret, scope FROM ct_extensions WHERE pk > %s AND extension_name LIKE %s ORDER BY pk LIMIT %s', (after, like_pattern(search), limit))
+        return self.iter_db_query('get_extensions', 'SELECT pk, extension_code, extension_name, description, authorization_url, token_url, client_id, client_secret, scope FROM ct_extensions WHERE pk > %s ORDER BY pk LIMIT %s', (after, limit))
 
-    def get_installed_extensions(self, account_id):
-        return self.execute_db_query("""
-            SELECT e.extension_name, e.description, wsp.app_key, wsp.app_secret, ei.installation_id
-            FROM ct_extension_installations ei
-            JOIN ct_extensions e ON ei.extension_pk = e.pk
-            JOIN ct_accounts a ON ei.account_id = a.acct_id
-            JOIN ct_ws_profiles wsp ON ei.pk = wsp.extension_installation_pk
-            WHERE ei.account_id = %s
-        """, (account_id,))
-
-    def get_available_extensions(self, account_id):
-        return self.execute_db_query("""
-            SELECT e.extension_name, e.description, e.extension_code
+    def get_extension_catalog(self, account_id):
+        # Every extension, joined to this account's installations of it. Rows with no installation
+        # (the LEFT JOIN anti-join) are available to install; the rest are installed.
+        return self.execute_db_query('get_extension_catalog', """
+            SELECT e.extension_name, e.description, wsp.app_key, wsp.app_secret, ei.installation_id, e.extension_code, wsp.profile_id
             FROM ct_extensions e
-            WHERE e.pk NOT IN (
-                SELECT extension_pk FROM ct_extension_installations WHERE account_id = %s
-            )
-        """, (account_id,))
+            LEFT JOIN ct_extension_installations ei ON ei.extension_pk = e.pk AND ei.account_id = %s
+            LEFT JOIN ct_ws_profiles wsp ON wsp.extension_installation_pk = ei.pk
+            ORDER BY e.pk, ei.pk
+        """, (account_id,)) or []
     
     def get_extension_link(self, installed_extension):
         installation_id = installed_extension[4]
@@ -400,26 +2632,26 @@ class MyHandler(http.server.SimpleHTTPRequestHandler):
         else:
             return f'<a href="/{installation_id}/ws-profile/">Update WS Profile</a>'
 
+    def first_row(self, rows):
+        # For the cached lookups: a failed query answers 500 (the caller's 404 is then dropped) and isn't cached
+        if rows is None:
+            self.send_text(500, b"Database error occurred.")
+            return MISSING
+        return rows[0] if rows else None
+
     def get_extension_by_code(self, extension_code):
-        extensions_data = self.execute_db_query('SELECT pk, extension_code, extension_name, description, authorization_url, token_url, client_id, client_secret, scope FROM ct_extensions WHERE extension_code = %s', (extension_code,))
-        return extensions_data[0] if extensions_data else None
+        return lookup_cache.get_or_load(('extension', extension_code), lambda: self.load_extension_by_code(extension_code))
 
-    def get_extension_installation_by_id(self, installation_id):
-        extension_installations_data = self.execute_db_query('SELECT ei.pk, ei.account_id, e.extension_code FROM ct_extension_installations ei JOIN ct_extensions e ON ei.extension_pk = e.pk WHERE installation_id = %s', (installation_id,))
-        return extension_installations_data[0] if extension_installations_data else None
+    def load_extension_by_code(self, extension_code):
+        extensions_data = self.execute_db_query('load_extension_by_code', 'SELECT pk, extension_code, extension_name, description, authorization_url, token_url, client_id, client_secret, scope FROM ct_extensions WHERE extension_code = %s', (extension_code,))
+        return self.first_row(extensions_data)
 
-    def get_latest_extension_installation(self):
-        extension_installations_data = self.execute_db_query('SELECT pk, account_id FROM ct_extension_installations ORDER BY pk DESC LIMIT 1')
-        return extension_installations_data[0] if extension_installations_data else None  
-    
     def submit_extension(self, data):
         params = urllib.parse.parse_qs(data.decode())
         extension_code = self.generate_random_code()
         db = self.connect_db()
         if not db:
-            self.send_response(500)
-            self.end_headers()
-            self.wfile.write(b"Database connection failed.")
+            self.send_text(500, b"Database connection failed.")
             return
         try:
             cursor = db.cursor()
@@ -430,33 +2662,37 @@ class MyHandler(http.server.SimpleHTTPRequestHandler):
                             params.get('authorization_url')[0], params.get('token_url')[0],
                             params.get('client_id')[0], params.get('client_secret')[0], params.get('scope')[0]))  
             db.commit()
+            lookup_cache.invalidate(('extension', extension_code))
         except mysql.connector.Error as err:
-            print(f"Database error: {err}")
-            self.send_response(500)
-            self.end_headers()
-            self.wfile.write(b"Database error occurred.")
+            db_pool.failed(db, err)
+            logger.error("Database error: %s", err)
+            self.send_text(500, b"Database error occurred.")
         finally:
             cursor.close()
-            db.close()
+            self.release_db(db)
 
-    def get_accounts(self):
-        return self.execute_db_query('SELECT acct_id, acct_name, acct_friendly_name, acct_url, disabled FROM ct_accounts')
+    def get_accounts(self, after=0, limit=PAGE_SIZE, search=''):
+        if search:
+            pattern = like_pattern(search)
+            return self.iter_db_query('get_accounts', 'SELECT acct_id, acct_name, acct_friendly_name, acct_url, disabled FROM ct_accounts WHERE acct_id > %s AND (acct_name LIKE %s OR acct_friendly_name LIKE %s OR acct_url LIKE %s) ORDER BY acct_id LIMIT %s', (after, pattern, pattern, pattern, limit))
+        return self.iter_db_query('get_accounts', 'SELECT acct_id, acct_name, acct_friendly_name, acct_url, disabled FROM ct_accounts WHERE acct_id > %s ORDER BY acct_id LIMIT %s', (after, limit))
 
     def get_account_by_id(self, account_id):
-        accounts_data = self.execute_db_query('SELECT acct_id, acct_name, acct_friendly_name, acct_url, disabled FROM ct_accounts WHERE acct_id = %s', (account_id,))
-        return accounts_data[0] if accounts_data else None
+        return lookup_cache.get_or_load(('account', str(account_id)), lambda: self.load_account_by_id(account_id))
+
+    def load_account_by_id(self, account_id):
+        accounts_data = self.execute_db_query('load_account_by_id', 'SELECT acct_id, acct_name, acct_friendly_name, acct_url, disabled FROM ct_accounts WHERE acct_id = %s', (account_id,))
+        return self.first_row(accounts_data)
 
     def get_account_by_url(self, account_url):
-        accounts_data = self.execute_db_query('SELECT acct_id, acct_name, acct_friendly_name, acct_url, disabled FROM ct_accounts WHERE acct_url = %s', (account_url,))
+        accounts_data = self.execute_db_query('get_account_by_url', 'SELECT acct_id, acct_name, acct_friendly_name, acct_url, disabled FROM ct_accounts WHERE acct_url = %s', (account_url,))
         return accounts_data[0] if accounts_data else None
     
     def submit_account(self, data):
         params = urllib.parse.parse_qs(data.decode())
         db = self.connect_db()
         if not db:
-            self.send_response(500)
-            self.end_headers()
-            self.wfile.write(b"Database connection failed.")
+            self.send_text(500, b"Database connection failed.")
             return
         try:
             cursor = db.cursor()
@@ -465,43 +2701,35 @@ class MyHandler(http.server.SimpleHTTPRequestHandler):
                            (params.get('acct_name')[0], params.get('acct_friendly_name')[0],
                             params.get('acct_url')[0], params.get('disabled', [0])[0]))  
             db.commit()
+            lookup_cache.invalidate(('account', str(cursor.lastrowid)))
         except mysql.connector.Error as err:
-            print(f"Database error: {err}")
-            self.send_response(500)
-            self.end_headers()
-            self.wfile.write(b"Database error occurred.")
+            db_pool.failed(db, err)
+            logger.error("Database error: %s", err)
+            self.send_text(500, b"Database error occurred.")
         finally:
             cursor.close()
-            db.close()
+            self.release_db(db)
     
-    def handle_installation(self, account_url):
-        # Extract the extension code from the URL
-        # Assuming the code is in the second to last part of the URL
-        extension_code = self.path.split('/')[-2]  
+    def handle_installation(self, extension_code, account_url):
         extensions_data = self.get_extension_by_code(extension_code)
         if not extensions_data:
-            self.send_response(404)
-            self.end_headers()
-            self.wfile.write(b"Extension not found.")
+            self.send_text(404, b"Extension not found.")
             return
         
         extension_pk, authorization_url, client_id, scope = extensions_data[0], extensions_data[4], extensions_data[6], extensions_data[8]
         accounts_data = self.get_account_by_url(account_url)
         if not accounts_data:
-            self.send_response(404)
-            self.end_headers()
-            self.wfile.write(b"Account not found.")
+            self.send_text(404, b"Account not found.")
             return
         
         account_id = accounts_data[0]
         db = self.connect_db()
         if not db:
-            self.send_response(500)
-            self.end_headers()
-            self.wfile.write(b"Database connection failed.")
+            self.send_text(500, b"Database connection failed.")
             return
         try:
             cursor = db.cursor()
+            db.start_transaction()
 
             installation_id = self.generate_random_code()
             query = """
@@ -525,37 +2753,48 @@ class MyHandler(http.server.SimpleHTTPRequestHandler):
             """
             cursor.execute(ws_query, (account_id, 'Extension_'+extension_code, extension_installation_pk))
 
+            # The callback finds this installation by its state, not by guessing the latest row
+            state = pending_installs.issue(cursor, extension_installation_pk, account_id, extension_code)
+
             db.commit()
+            pending_installs.remember(state, extension_installation_pk, account_id, extension_code)
         except mysql.connector.Error as err:
+            db_pool.failed(db, err)
             db.rollback()
-            print(f"Database error: {err}")
-            self.send_response(500)
-            self.end_headers()
-            self.wfile.write(b"Database error occurred.")
+            logger.error("Database error: %s", err)
+            self.send_text(500, b"Database error occurred.")
+            return
         finally:
             cursor.close()
-            db.close()
+            self.release_db(db)
 
-        auth_url = f"{authorization_url}?client_id={client_id}&scope={scope}&redirect_uri={APP_URL}/callback/{extension_code}"
-        self.send_response(302)
-        self.send_header('Location', auth_url)
-        self.end_headers()
+        auth_url = f"{authorization_url}?client_id={client_id}&scope={scope}&redirect_uri={APP_URL}/callback/{extension_code}&state={state}"
+        self.send_redirect(302, auth_url)
 
     def handle_callback(self, extension_code):
         query = urllib.parse.urlparse(self.path).query
         params = urllib.parse.parse_qs(query)
         authorization_code = params.get('code')
         if not authorization_code:
-            self.send_response(400)
-            self.end_headers()
-            self.wfile.write(b"Missing authorization code.")
+            self.send_text(400, b"Missing authorization code.")
             return
 
+        state = params.get('state', [''])[0]
+        try:
+            pending = pending_installs.resolve(state) if state else None
+        except mysql.connector.Error as err:
+            logger.error("Database error: %s", err)
+            self.send_text(500, b"Database error occurred.")
+            return
+        # Checked before the code is exchanged, so a forged or stale callback costs no token request
+        if not pending or pending[2] != extension_code:
+            self.send_text(400, b"Invalid or expired installation state.")
+            return
+        extension_installation_pk, account_id = pending[0], pending[1]
+
         extensions_data = self.get_extension_by_code(extension_code)
         if not extensions_data:
-            self.send_response(404)
-            self.end_headers()
-            self.wfile.write(b"Extension not found.")
+            self.send_text(404, b"Extension not found.")
             return
  
         token_url, client_id, client_secret = extensions_data[5], extensions_data[6], extensions_data[7]
@@ -567,120 +2806,151 @@ class MyHandler(http.server.SimpleHTTPRequestHandler):
             'grant_type': 'authorization_code'
         }
 
-        response = requests.post(token_url, data=token_data)
-        token_response = response.json()
+        try:
+            response = http_client.post(token_url, target='oauth_token', data=token_data,
+                                        timeout=(HTTP_CONNECT_TIMEOUT, OAUTH_EXCHANGE_TIMEOUT))
+            token_response = response.json()
+        except (requests.RequestException, ValueError) as err:
+            logger.error("API request error: %s", err)
+            self.send_text(502, b"Token endpoint request failed.")
+            return
         if not token_response.get("ok"):
-            self.send_response(400)
-            self.end_headers()
-            self.wfile.write(f"Error exchanging authorization code for access token: {token_response.get('error')}".encode())
+            self.send_text(400, f"Error exchanging authorization code for access token: {token_response.get('error')}".encode())
             return
 
         access_token = token_response.get('access_token')
         if not access_token:
-            self.send_response(400)
-            self.end_headers()
-            self.wfile.write(b"Access token not found in response.")
+            self.send_text(400, b"Access token not found in response.")
             return
 
         db = self.connect_db()
         if not db:
-            self.send_response(500)
-            self.end_headers()
-            self.wfile.write(b"Database connection failed.")
+            self.send_text(500, b"Database connection failed.")
             return
         try:
             cursor = db.cursor()
-
-            extension_installation_data = self.get_latest_extension_installation()
-            if not extension_installation_data:
-                self.send_response(404)
-                self.end_headers()
-                self.wfile.write(b"Extension not found.")
+            if not pending_installs.complete(cursor, state, access_token):
+                self.send_text(409, b"Installation already completed.")
                 return
-            
-            extension_installation_pk, account_id = extension_installation_data[0], extension_installation_data[1]
-            cursor.execute(
-                "UPDATE ct_extension_installations SET token = %s WHERE pk = %s",
-                (access_token, extension_installation_pk)
-            )
-                
             db.commit()
+            slack_tokens.set(extension_installation_pk, access_token)
         except mysql.connector.Error as err:
+            db_pool.failed(db, err)
             db.rollback()
-            print(f"Database error: {err}")
-            self.send_response(500)
-            self.end_headers()
-            self.wfile.write(b"Database error occurred.")
+            logger.error("Database error: %s", err)
+            self.send_text(500, b"Database error occurred.")
             return
         finally:
             cursor.close()
-            db.close()
+            self.release_db(db)
     
         acct_ext_url = f"/accounts/{account_id}"
-        self.send_response(302)
-        self.send_header('Location', acct_ext_url)
-        self.end_headers()
+        self.send_redirect(302, acct_ext_url)
+
+    def check_installation_page(self, page):
+        if not page:
+            self.send_text(404, b"Extension Installation not found.")
+            return False
+
+        if page.acct_name is None:
+            self.send_text(404, b"Account not found.")
+            return False
+
+        if page.profile_id is None:
+            self.send_text(404, b"Web Service Profile not found.")
+            return False
+        return True
+
+    def load_installation_page(self, installation_id):
+        # Installation, account and web service profile in one round-trip; LEFT JOINs keep the
+        # row so a missing account or profile can still be reported separately.
+        page_data = self.execute_db_query('load_installation_page', """
+            SELECT ei.pk, ei.account_id, e.extension_code, a.acct_name, a.acct_url, wsp.profile_id, wsp.profile_name
+            FROM ct_extension_installations ei
+            JOIN ct_extensions e ON ei.extension_pk = e.pk
+            LEFT JOIN ct_accounts a ON ei.account_id = a.acct_id
+            LEFT JOIN ct_ws_profiles wsp ON wsp.extension_installation_pk = ei.pk
+            WHERE ei.installation_id = %s
+            ORDER BY wsp.profile_id
+            LIMIT 1
+        """, (installation_id,))
+        return InstallationPage(*page_data[0]) if page_data else None
+
+    def load_actions_page(self, installation_id, after=0, limit=None, search=''):
+        # The keyset and filter go in the JOIN condition so the installation row still comes back
+        # (with NULL action columns) when no action matches.
+        action_filter = 'AND ea.action_name LIKE %s' if search else ''
+        params = (after,) + ((like_pattern(search),) if search else ()) + (installation_id, limit or PAGE_SIZE_MAX)
+        rows = self.iter_db_query('load_actions_page', f"""
+            SELECT ei.pk, ei.account_id, e.extension_code, a.acct_name, a.acct_url,
+                ea.action_id, ea.action_name, ea.action_code, ea.event_object, ea.event_type,
+                ea.event_input_field, ea.action_object, ea.action_type, ea.action_output_field
+            FROM ct_extension_installations ei
+            JOIN ct_extensions e ON ei.extension_pk = e.pk
+            LEFT JOIN ct_accounts a ON ei.account_id = a.acct_id
+            LEFT JOIN ct_extension_actions ea ON ea.extension_installation_pk = ei.pk
+                AND ea.action_id > %s {action_filter}
+            WHERE ei.installation_id = %s
+            ORDER BY ea.action_id
+            LIMIT %s
+        """, params)
+        if rows is None:
+            return None, None, None
+        first = next(rows, None)
+        if first is None:
+            return None, None, rows
+        page = InstallationPage(*first[:5], None, None)
+        return page, first, rows
+
+    def iter_action_rows(self, first, rows):
+        try:
+            if first[5] is not None:
+                yield ActionRow(*first[5:])
+            for row in rows:
+                yield ActionRow(*row[5:])
+        finally:
+            rows.close()
 
-    def get_actions(self, extension_installation_pk):
-        return self.execute_db_query('SELECT ea.action_id, ea.extension_installation_pk, ea.profile_id, ea.webhook_event_id, ea.action_name, ea.action_code, ea.event_object, ea.event_type, ea.event_input_field, ea.action_object, ea.action_type, ea.action_output_field FROM ct_extension_actions ea JOIN ct_extension_installations ei ON ea.extension_installation_pk = ei.pk WHERE ea.extension_installation_pk = %s', (extension_installation_pk,))
-    
     def submit_action(self, data):
         params = urllib.parse.parse_qs(data.decode())
-        db = self.connect_db()
-        if not db:
-            self.send_response(500)
-            self.end_headers()
-            self.wfile.write(b"Database connection failed.")
-            return
+        extension_installation_pk = params.get('extension_installation_pk')[0]
+        profile_id = params.get('profile_id')[0]
+        action_name = params.get('action_name')[0]
+        action_code = self.generate_random_code()
+        event_object = params.get('event_object')[0]
+        event_type = params.get('event_type')[0]
+        event_input_field = params.get('event_input_field')[0]
+        action_object = params.get('action_object')[0]
+        action_type = params.get('action_type')[0]
+        action_output_field = params.get('action_output_field')[0]
+
+        # Compiled here too, so a bad template is rejected before the webhook event is registered
         try:
-            cursor = db.cursor()
-            extension_installation_pk = params.get('extension_installation_pk')[0]
-            profile_id = params.get('profile_id')[0]
-            action_name = params.get('action_name')[0]
-            action_code = self.generate_random_code()
-            event_object = params.get('event_object')[0]
-            event_type = params.get('event_type')[0]
-            event_input_field = params.get('event_input_field')[0]
-            action_object = params.get('action_object')[0]
-            action_type = params.get('action_type')[0]
-            action_output_field = params.get('action_output_field')[0]
-
-            ws_profile_data = self.get_ws_profile_by_id(extension_installation_pk)
-            if not ws_profile_data:
-                self.send_response(404)
-                self.end_headers()
-                self.wfile.write(b"Web Service Profile not found.")
-                return
-
-            client_id, client_secret, token_url = ws_profile_data[3], ws_profile_data[4], ws_profile_data[5]
+            ActionTemplate(event_input_field, action_output_field)
+        except ValueError as err:
+            self.send_text(400, f"Invalid action output field: {err}".encode())
+            return
 
-            base_url = f"{urllib.parse.urlparse(token_url).scheme}://{urllib.parse.urlparse(token_url).netloc}/"
+        ws_profile_data = self.get_ws_profile_by_id(extension_installation_pk)
+        if not ws_profile_data:
+            self.send_text(404, b"Web Service Profile not found.")
+            return
 
-            # Get authentication token
-            auth_response = requests.post(token_url, data={
-                'grant_type': 'client_credentials', 
-                'client_id': client_id,
-                'client_secret': client_secret
-            })
+        client_id, client_secret, token_url = ws_profile_data[3], ws_profile_data[4], ws_profile_data[5]
 
-            if auth_response.status_code != 200:
-                self.send_response(500)
-                self.end_headers()
-                self.wfile.write(b"Failed to authenticate.")
-                return
+        base_url = f"{urllib.parse.urlparse(token_url).scheme}://{urllib.parse.urlparse(token_url).netloc}/"
 
-            token = auth_response.json().get('access_token')
-            if not token:
-                self.send_response(500)
-                self.end_headers()
-                self.wfile.write(b"Access token not found in response.")
+        try:
+            # Get authentication token
+            try:
+                token = oauth_tokens.get(token_url, client_id, client_secret)
+            except TokenError as err:
+                self.send_text(500, str(err).encode())
                 return
 
             webhook_data = self.get_webhook_by_id(extension_installation_pk)
             if not webhook_data:
-                self.send_response(404)
-                self.end_headers()
-                self.wfile.write(b"Webhook not found.")
+                self.send_text(404, b"Webhook not found.")
                 return
 
             webhook_code = webhook_data[1]
@@ -692,16 +2962,28 @@ class MyHandler(http.server.SimpleHTTPRequestHandler):
             }
 
             # Call the specific POST API with the token
-            api_response = requests.post(specific_api_url, json=event_data, headers={'Authorization': f'Bearer {token}'})
+            api_response = http_client.post(specific_api_url, target='outgoing_webhooks', json=event_data, headers={'Authorization': f'Bearer {token}'})
+            if api_response.status_code == 401:
+                oauth_tokens.invalidate(token_url, client_id)
             
             if api_response.status_code != 201:
-                self.send_response(500)
-                self.end_headers()
-                self.wfile.write(b"Failed to call specific API.")
+                self.send_text(500, b"Failed to call specific API.")
                 return
 
             event_response = api_response.json()
             webhook_event_id = event_response.get('Id')
+        except requests.RequestException as err:
+            logger.error("API request error: %s", err)
+            self.send_text(500, b"API request error occurred.")
+            return
+
+        # Only hold a pooled connection for the insert, not across the API calls above
+        db = self.connect_db()
+        if not db:
+            self.send_text(500, b"Database connection failed.")
+            return
+        try:
+            cursor = db.cursor()
             cursor.execute('''INSERT INTO ct_extension_actions (extension_installation_pk, profile_id, webhook_event_id, 
                            action_name, action_code, event_object,
                            event_type, event_input_field, action_object,
@@ -713,77 +2995,57 @@ class MyHandler(http.server.SimpleHTTPRequestHandler):
                             action_type, action_output_field))
             db.commit()
         except mysql.connector.Error as err:
-            print(f"Database error: {err}")
-            self.send_response(500)
-            self.end_headers()
-            self.wfile.write(b"Database error occurred.")
+            db_pool.failed(db, err)
+            logger.error("Database error: %s", err)
+            self.send_text(500, b"Database error occurred.")
         finally:
             cursor.close()
-            db.close()
+            self.release_db(db)
     
     def get_ws_profile_by_id(self, extension_installation_pk):
-        ws_profile_data = self.execute_db_query('SELECT wsp.profile_id, wsp.account_id, wsp.profile_name, wsp.app_key, wsp.app_secret, wsp.token_url, wsp.extension_installation_pk FROM ct_ws_profiles wsp JOIN ct_extension_installations ei ON wsp.extension_installation_pk = ei.pk WHERE wsp.extension_installation_pk = %s', (extension_installation_pk,))
+        ws_profile_data = self.execute_db_query('get_ws_profile_by_id', 'SELECT wsp.profile_id, wsp.account_id, wsp.profile_name, wsp.app_key, wsp.app_secret, wsp.token_url, wsp.extension_installation_pk FROM ct_ws_profiles wsp JOIN ct_extension_installations ei ON wsp.extension_installation_pk = ei.pk WHERE wsp.extension_installation_pk = %s', (extension_installation_pk,))
         return ws_profile_data[0] if ws_profile_data else None    
 
     def update_ws_profile(self, data):
         params = urllib.parse.parse_qs(data.decode())
-        db = self.connect_db()
-        if not db:
-            self.send_response(500)
-            self.end_headers()
-            self.wfile.write(b"Database connection failed.")
+        token_url = params.get('token_url', [None])[0]
+        client_id = params.get('app_key', [None])[0]
+        client_secret = params.get('app_secret', [None])[0]
+        profile_id = params.get('profile_id', [None])[0]
+        name = params.get('profile_name', [None])[0]
+        extension_code = params.get('extension_code', [None])[0]
+        extension_installation_pk = params.get('extension_installation_pk', [None])[0]
+
+        # Validate required parameters
+        if not all([token_url, client_id, client_secret, profile_id, name, extension_code]):
+            self.send_text(400, b"All parameters are required.")
             return
-        try:
-            cursor = db.cursor()
-            token_url = params.get('token_url', [None])[0]
-            client_id = params.get('app_key', [None])[0]
-            client_secret = params.get('app_secret', [None])[0]
-            profile_id = params.get('profile_id', [None])[0]
-            name = params.get('profile_name', [None])[0]
-            extension_code = params.get('extension_code', [None])[0]
-            extension_installation_pk = params.get('extension_installation_pk', [None])[0]
-
-            # Validate required parameters
-            if not all([token_url, client_id, client_secret, profile_id, name, extension_code]):
-                self.send_response(400)
-                self.end_headers()
-                self.wfile.write(b"All parameters are required.")
-                return
 
-            query = '''UPDATE ct_ws_profiles 
-                    SET app_key = %s, app_secret = %s, token_url = %s 
-                    WHERE profile_id = %s'''
-            cursor.execute(query, (client_id, client_secret, token_url, profile_id))
+        # The old credentials, so the token cached under them can be dropped too
+        previous = self.execute_db_query('update_ws_profile', 'SELECT token_url, app_key FROM ct_ws_profiles WHERE profile_id = %s', (profile_id,))
+        if previous is None:
+            return
+        if not previous:
+            self.send_text(404, b"Profile ID not found.")
+            return
 
-            if cursor.rowcount == 0:
-                self.send_response(404)
-                self.end_headers()
-                self.wfile.write(b"Profile ID not found.")
-                return
+        # The profile's credentials are changing, so never reuse a token fetched with the old ones
+        oauth_tokens.invalidate(*previous[0])
+        oauth_tokens.invalidate(token_url, client_id)
 
-            base_url = f"{urllib.parse.urlparse(token_url).scheme}://{urllib.parse.urlparse(token_url).netloc}/"
+        base_url = f"{urllib.parse.urlparse(token_url).scheme}://{urllib.parse.urlparse(token_url).netloc}/"
+        outgoing_url = f"{APP_URL}/{extension_code}/handleAsync"
 
+        # The upstream calls come first: a slow token or webhooks endpoint must not hold a pooled
+        # connection, or the profile's row lock, for up to the HTTP timeout
+        try:
             # Get authentication token
-            auth_response = requests.post(token_url, data={
-                'grant_type': 'client_credentials', 
-                'client_id': client_id,
-                'client_secret': client_secret
-            })
-
-            if auth_response.status_code != 200:
-                self.send_response(500)
-                self.end_headers()
-                self.wfile.write(b"Failed to authenticate.")
-                return
-
-            token = auth_response.json().get('access_token')
-            if not token:
-                self.send_response(500)
-                self.end_headers()
-                self.wfile.write(b"Access token not found in response.")
+            try:
+                token = oauth_tokens.get(token_url, client_id, client_secret)
+            except TokenError as err:
+                self.send_text(500, str(err).encode())
                 return
 
-            outgoing_url = f"{APP_URL}/{extension_code}/handleAsync"
             specific_api_url = f"{base_url}rest/v2/outgoingWebhooks"
 
             webhook_data = {
@@ -792,17 +3054,33 @@ class MyHandler(http.server.SimpleHTTPRequestHandler):
             }
 
             # Call the specific POST API with the token
-            api_response = requests.post(specific_api_url, json=webhook_data, headers={'Authorization': f'Bearer {token}'})
+            api_response = http_client.post(specific_api_url, target='outgoing_webhooks', json=webhook_data, headers={'Authorization': f'Bearer {token}'})
+            if api_response.status_code == 401:
+                oauth_tokens.invalidate(token_url, client_id)
             
             if api_response.status_code != 201:
-                self.send_response(500)
-                self.end_headers()
-                self.wfile.write(b"Failed to call specific API.")
+                self.send_text(500, b"Failed to call specific API.")
                 return
 
             webhook_response = api_response.json()
             webhook_code = webhook_response.get('Id')
             secret = webhook_response.get('Secret')
+        except requests.RequestException as err:
+            logger.error("API request error: %s", err)
+            self.send_text(500, b"API request error occurred.")
+            return
+
+        db = self.connect_db()
+        if not db:
+            self.send_text(500, b"Database connection failed.")
+            return
+        try:
+            cursor = db.cursor()
+            db.start_transaction()
+            query = '''UPDATE ct_ws_profiles 
+                    SET app_key = %s, app_secret = %s, token_url = %s 
+                    WHERE profile_id = %s'''
+            cursor.execute(query, (client_id, client_secret, token_url, profile_id))
 
             insert_query = '''INSERT INTO ct_webhooks (webhook_code, webhook_name, secret, extension_installation_pk)
                             VALUES (%s, %s, %s, %s)'''
@@ -816,39 +3094,113 @@ class MyHandler(http.server.SimpleHTTPRequestHandler):
             cursor.execute(insert_url_query, (outgoing_url, webhook_id))
             db.commit()
         except mysql.connector.Error as err:
+            db_pool.failed(db, err)
             db.rollback()
-            print(f"Database error: {err}")
-            self.send_response(500)
-            self.end_headers()
-            self.wfile.write(b"Database error occurred.")
-        except requests.RequestException as err:
-            print(f"API request error: {err}")
-            self.send_response(500)
-            self.end_headers()
-            self.wfile.write(b"API request error occurred.")
+            logger.error("Database error: %s", err)
+            self.send_text(500, b"Database error occurred.")
         finally:
             cursor.close()
-            db.close()
+            self.release_db(db)
 
     def get_webhook_by_id(self, extension_installation_pk):
-        ws_profile_data = self.execute_db_query('SELECT w.id, w.webhook_code, w.webhook_name, w.secret, w.extension_installation_pk FROM ct_webhooks w JOIN ct_extension_installations ei ON w.extension_installation_pk = ei.pk WHERE w.extension_installation_pk = %s', (extension_installation_pk,))
-        return ws_profile_data[0] if ws_profile_data else None  
-    
-    def send_message_to_slack(self, channel, message, token):
-        url = 'https://slack.com/api/chat.postMessage'
-        headers = {
-            'Content-Type': 'application/json',
-            'Authorization': f'Bearer {token}'
-        }
-        payload = {
-            'channel': channel,
-            'text': message
-        }
-        
-        response = requests.post(url, headers=headers, data=json.dumps(payload))
-        return response.json()
+        ws_profile_data = self.execute_db_query('get_webhook_by_id', 'SELECT w.id, w.webhook_code, w.webhook_name, w.secret, w.extension_installation_pk FROM ct_webhooks w JOIN ct_extension_installations ei ON w.extension_installation_pk = ei.pk WHERE w.extension_installation_pk = %s', (extension_installation_pk,))
+        return ws_profile_data[0] if ws_profile_data else None
+
+def serve(listener=None, deliver=True):
+    log_listener = setup_logging()
+    try:
+        logger.info("Loaded %s Slack tokens", slack_tokens.warm())
+    except mysql.connector.Error as err:
+        # Tokens then load per installation on first use
+        logger.error("Slack token warm-up failed: %s", err)
+    slack_outbox.start(deliver)
+    try:
+        with ThreadPoolHTTPServer(("", PORT), MyHandler, listener=listener) as httpd:
+            signal.signal(signal.SIGTERM, lambda signum, frame: httpd.drain())
+            logger.info("Serving on port %s with %s threads", PORT, MAX_WORKERS)
+            httpd.serve_forever()
+    finally:
+        slack_outbox.stop()
+        log_listener.stop()
+
+STOP_SIGNALS = {signal.SIGTERM, signal.SIGINT}
+
+def supervise(workers):
+    # Pre-fork mode: the supervisor owns the listening socket and forks workers that share it.
+    # Each worker builds its own DB pool, HTTP sessions and caches on first use; nothing here
+    # opens a connection or starts a thread before forking.
+    setup_logging(background=False)
+    listener = socket.create_server(("", PORT), backlog=REQUEST_QUEUE_SIZE)
+    # Every idle worker wakes for a new connection; the ones that lose the accept move on
+    listener.setblocking(False)
+    children = {}
+    stopping = []
+
+    def spawn(index):
+        # A SIGTERM between fork() and registering the pid would skip the new worker and leave
+        # the loop below waiting on it forever, so stop() is held off until it's in children
+        signal.pthread_sigmask(signal.SIG_BLOCK, STOP_SIGNALS)
+        try:
+            pid = os.fork()
+            if pid == 0:
+                code = 1
+                try:
+                    # The supervisor turns Ctrl-C into SIGTERM for everyone
+                    signal.signal(signal.SIGINT, signal.SIG_IGN)
+                    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+                    signal.pthread_sigmask(signal.SIG_UNBLOCK, STOP_SIGNALS)
+                    serve(listener, deliver=index == 0)
+                    code = 0
+                except BaseException:
+                    traceback.print_exc()
+                finally:
+                    os._exit(code)
+            children[pid] = (index, time.monotonic())
+        finally:
+            signal.pthread_sigmask(signal.SIG_UNBLOCK, STOP_SIGNALS)
+
+    def stop(signum, frame):
+        if not stopping:
+            stopping.append(time.monotonic() + SHUTDOWN_TIMEOUT)
+            for pid in children:
+                os.kill(pid, signal.SIGTERM)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for index in range(workers):
+        spawn(index)
+    logger.info("Supervising %s workers on port %s", workers, PORT)
+
+    while children:
+        pid, status = os.waitpid(-1, os.WNOHANG)
+        if pid == 0:
+            if stopping and time.monotonic() > stopping[0]:
+                logger.warning("Workers did not drain in %ss, killing them", SHUTDOWN_TIMEOUT)
+                for pid in children:
+                    os.kill(pid, signal.SIGKILL)
+                stopping[0] = float('inf')
+            time.sleep(0.1)
+            continue
+        index, started = children.pop(pid)
+        if stopping:
+            continue
+        logger.error("Worker %s (pid %s) exited with status %s, restarting", index, pid, os.waitstatus_to_exitcode(status))
+        if time.monotonic() - started < 1:
+            # Don't spin if a worker dies at startup
+            time.sleep(1)
+        # stop() may have run during the sleep
+        if not stopping:
+            spawn(index)
+    listener.close()
 
 if __name__ == "__main__":
-    with socketserver.TCPServer(("", PORT), MyHandler) as httpd:
-        print(f"Serving on port {PORT}")
-        httpd.serve_forever()
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', type=int, default=1, help='pre-fork this many worker processes')
+    args = parser.parse_args()
+    # Built once in the supervisor so forked workers share the pages copy-on-write
+    asset_manifest.load()
+    template_cache.load_all()
+    if args.workers > 1:
+        supervise(args.workers)
+    else:
+        serve()
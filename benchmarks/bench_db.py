@@ -0,0 +1,17 @@
+# Shared by the benchmarks that run against MySQL. They use a database of their own
+# (BENCH_MYSQL_DB, default extension_bench) on the configured server, never MYSQL_DB itself.
+import os
+import mysql.connector
+
+BENCH_DB = os.getenv('BENCH_MYSQL_DB', 'extension_bench')
+
+def create_database():
+    db = mysql.connector.connect(
+        host=os.getenv('MYSQL_HOST'),
+        user=os.getenv('MYSQL_USER'),
+        password=os.getenv('MYSQL_PASSWORD')
+    )
+    cursor = db.cursor()
+    cursor.execute(f"CREATE DATABASE IF NOT EXISTS `{BENCH_DB}`")
+    cursor.close()
+    db.close()
@@ -0,0 +1,119 @@
+# Compares the old installed/available query pair on /accounts/<id> with the single catalog query.
+#
+# Seeds a separate database (BENCH_MYSQL_DB, default extension_bench) on the configured MySQL server,
+# so never point it at production data. Run from the repository root:
+#
+#   python -m benchmarks.catalog_query --extensions 5000 --accounts 200 --installations 20000
+import os
+import sys
+import time
+import random
+import argparse
+import statistics
+
+from benchmarks.bench_db import BENCH_DB, create_database
+
+os.environ['MYSQL_DB'] = BENCH_DB
+for var, default in [('APP_URL', 'http://localhost:8000'), ('PORT', '8000'), ('SLACK_TOKEN', 'xoxb-bench')]:
+    os.environ.setdefault(var, default)
+
+import db_setup
+import app
+
+OLD_INSTALLED_QUERY = """
+    SELECT e.extension_name, e.description, wsp.app_key, wsp.app_secret, ei.installation_id
+    FROM ct_extension_installations ei
+    JOIN ct_extensions e ON ei.extension_pk = e.pk
+    JOIN ct_accounts a ON ei.account_id = a.acct_id
+    JOIN ct_ws_profiles wsp ON ei.pk = wsp.extension_installation_pk
+    WHERE ei.account_id = %s
+"""
+
+OLD_AVAILABLE_QUERY = """
+    SELECT e.extension_name, e.description, e.extension_code
+    FROM ct_extensions e
+    WHERE e.pk NOT IN (
+        SELECT extension_pk FROM ct_extension_installations WHERE account_id = %s
+    )
+"""
+
+def seed(extensions, accounts, installations):
+    db = db_setup.connect_db()
+    cursor = db.cursor()
+    cursor.execute('SELECT COUNT(*) FROM ct_extensions')
+    if cursor.fetchone()[0] >= extensions:
+        print("Reusing existing seed data.")
+        cursor.close()
+        db.close()
+        return
+
+    code = lambda i: f"{i:06x}"[-6:]
+    cursor.executemany(
+        'INSERT INTO ct_extensions (extension_code, extension_name, description, authorization_url, token_url, client_id, client_secret, scope) VALUES (%s, %s, %s, %s, %s, %s, %s, %s)',
+        [(code(i), f"Extension {i}", 'Benchmark extension', 'https://auth.example.com', 'https://auth.example.com/token', 'client', 'secret', 'chat:write')
+         for i in range(extensions)])
+    cursor.executemany(
+        'INSERT INTO ct_accounts (acct_name, acct_friendly_name, acct_url) VALUES (%s, %s, %s)',
+        [(f"account{i}", f"Account {i}", f"https://account{i}.example.com") for i in range(accounts)])
+    db.commit()
+
+    cursor.execute('SELECT pk FROM ct_extensions')
+    extension_pks = [pk for (pk,) in cursor.fetchall()]
+    cursor.execute('SELECT acct_id FROM ct_accounts')
+    account_ids = [acct_id for (acct_id,) in cursor.fetchall()]
+    pairs = set()
+    while len(pairs) < installations:
+        pairs.add((random.choice(extension_pks), random.choice(account_ids)))
+    cursor.executemany(
+        'INSERT INTO ct_extension_installations (installation_id, extension_pk, account_id) VALUES (%s, %s, %s)',
+        [(code(0x800000 + i), extension_pk, account_id) for i, (extension_pk, account_id) in enumerate(pairs)])
+    cursor.execute('''
+        INSERT INTO ct_ws_profiles (account_id, profile_name, app_key, app_secret, extension_installation_pk)
+        SELECT account_id, 'Default', IF(pk % 2, 'key', NULL), IF(pk % 2, 'secret', NULL), pk FROM ct_extension_installations
+    ''')
+    db.commit()
+    cursor.close()
+    db.close()
+    print(f"Seeded {extensions} extensions, {accounts} accounts, {installations} installations.")
+
+def measure(label, page, account_ids, rounds):
+    timings = []
+    for _ in range(rounds):
+        for acct_id in account_ids:
+            start = time.perf_counter()
+            page(acct_id)
+            timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    p95 = timings[int(len(timings) * 0.95) - 1]
+    print(f"{label:<32} mean {statistics.mean(timings):8.2f} ms   p50 {statistics.median(timings):8.2f} ms   p95 {p95:8.2f} ms")
+    return statistics.mean(timings)
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the /accounts/<id> extension catalog query.')
+    parser.add_argument('--extensions', type=int, default=5000)
+    parser.add_argument('--accounts', type=int, default=200)
+    parser.add_argument('--installations', type=int, default=20000)
+    parser.add_argument('--rounds', type=int, default=5)
+    parser.add_argument('--sample', type=int, default=20, help='accounts to load per round')
+    args = parser.parse_args()
+
+    create_database()
+    if not db_setup.run_migrations():
+        sys.exit(1)
+    seed(args.extensions, args.accounts, args.installations)
+
+    handler = object.__new__(app.MyHandler)
+    account_ids = [row[0] for row in handler.execute_db_query('sample_accounts', 'SELECT acct_id FROM ct_accounts ORDER BY acct_id LIMIT %s', (args.sample,))]
+
+    def old_page(acct_id):
+        handler.execute_db_query('old_installed', OLD_INSTALLED_QUERY, (acct_id,))
+        handler.execute_db_query('old_available', OLD_AVAILABLE_QUERY, (acct_id,))
+
+    # Warm the pool and the buffer pool before timing
+    measure('warm-up', old_page, account_ids[:2], 1)
+    old = measure('installed + NOT IN (2 queries)', old_page, account_ids, args.rounds)
+    new = measure('catalog anti-join (1 query)', handler.get_extension_catalog, account_ids, args.rounds)
+    print(f"Speedup: {old / new:.2f}x")
+
+if __name__ == "__main__":
+    main()
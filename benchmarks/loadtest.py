@@ -0,0 +1,340 @@
+# Load test for app.py against local stand-ins for its dependencies.
+#
+# Starts app.py as a child process on a MySQL database of its own (BENCH_MYSQL_DB, default
+# extension_bench, on the configured MySQL server) plus one fake upstream server. The fake
+# answers Slack's chat.postMessage, the OAuth token endpoint and the outgoingWebhooks API with
+# configurable latency and error rates. It then drives /handleAsync, /accounts/<id>, /extensions
+# and the install/callback flow at a fixed concurrency and reports throughput and p50/p95/p99.
+# Never point it at production data. Run from the repository root:
+#
+#   python -m benchmarks.loadtest --concurrency 32 --duration 30
+#   python -m benchmarks.loadtest --scenario handle_async --slack-latency-ms 200 --slack-error-rate 0.05
+#   python -m benchmarks.loadtest --save-baseline     # write benchmarks/baselines/loadtest.json
+#   python -m benchmarks.loadtest --compare           # exit 1 if a scenario regressed against it
+#
+# Baselines depend on the machine, so none is committed: record one with --save-baseline on the
+# machine that runs --compare.
+import os
+import sys
+import json
+import math
+import time
+import uuid
+import random
+import signal
+import argparse
+import threading
+import subprocess
+import http.client
+import http.server
+import urllib.parse
+
+from benchmarks.bench_db import BENCH_DB, create_database
+
+# db_setup and the app process started below both read MYSQL_DB from the environment
+os.environ['MYSQL_DB'] = BENCH_DB
+import db_setup
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), 'baselines', 'loadtest.json')
+CODE_PREFIX = 'lt'
+
+class FakeUpstream(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, services):
+        super().__init__(address, FakeUpstreamHandler)
+        # service -> (latency in seconds, error rate)
+        self.services = services
+        self.counts = {}
+        self.lock = threading.Lock()
+
+    def count(self, service, outcome):
+        with self.lock:
+            key = f"{service}_{outcome}"
+            self.counts[key] = self.counts.get(key, 0) + 1
+
+class FakeUpstreamHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        path = self.path.partition('?')[0]
+        if path == '/api/chat.postMessage':
+            service, status, body = 'slack', 200, {'ok': True, 'ts': f"{time.time():.6f}"}
+        elif path == '/oauth/token':
+            service, status, body = 'oauth', 200, {'ok': True, 'access_token': uuid.uuid4().hex, 'expires_in': 3600}
+        elif path == '/rest/v2/outgoingWebhooks':
+            service, status, body = 'webhooks', 201, {'Id': uuid.uuid4().hex[:12], 'Secret': uuid.uuid4().hex}
+        elif path.startswith('/rest/v2/outgoingWebhooks/') and path.endswith('/events'):
+            service, status, body = 'webhooks', 201, {'Id': uuid.uuid4().hex[:12]}
+        else:
+            self.reply(404, {'ok': False, 'error': 'not_found'})
+            return
+
+        latency, error_rate = self.server.services[service]
+        if latency:
+            time.sleep(latency * random.uniform(0.5, 1.5))
+        if random.random() < error_rate:
+            self.server.count(service, 'errors')
+            self.reply(503, {'ok': False, 'error': 'service_unavailable'})
+            return
+        self.server.count(service, 'ok')
+        self.reply(status, body)
+
+    def reply(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+def seed(extensions, accounts, upstream_url):
+    # Seed rows carry the upstream URL, so a different --upstream-port needs a fresh BENCH_MYSQL_DB
+    db = db_setup.connect_db()
+    cursor = db.cursor()
+    # INSERT IGNORE skips rows an earlier, smaller run already seeded
+    cursor.executemany(
+        'INSERT IGNORE INTO ct_extensions (extension_code, extension_name, description, authorization_url, token_url, client_id, client_secret, scope) VALUES (%s, %s, %s, %s, %s, %s, %s, %s)',
+        [(f"{CODE_PREFIX}{i:04x}", f"Load test extension {i}", 'Load test extension', f"{upstream_url}/oauth/authorize",
+          f"{upstream_url}/oauth/token", 'client', 'secret', 'chat:write') for i in range(extensions)])
+    new_extensions = cursor.rowcount
+    cursor.executemany(
+        'INSERT IGNORE INTO ct_accounts (acct_name, acct_friendly_name, acct_url) VALUES (%s, %s, %s)',
+        [(f"lt-account{i}", f"Load test account {i}", f"https://lt-account{i}.example.com") for i in range(accounts)])
+    new_accounts = cursor.rowcount
+    db.commit()
+    print(f"Seeded {new_extensions} extensions and {new_accounts} accounts.")
+
+    cursor.execute('SELECT extension_code FROM ct_extensions WHERE extension_code LIKE %s ORDER BY pk', (CODE_PREFIX + '%',))
+    codes = [code for (code,) in cursor.fetchall()]
+    cursor.execute("SELECT acct_id, acct_url FROM ct_accounts WHERE acct_name LIKE 'lt-account%' ORDER BY acct_id")
+    account_rows = cursor.fetchall()
+    cursor.close()
+    db.close()
+    return codes, account_rows
+
+def scenarios(codes, account_rows):
+    def handle_async(rng):
+        body = json.dumps({'channel': f"C{rng.randrange(50):04d}", 'message': f"Load test {uuid.uuid4().hex}"}).encode()
+        return [('handle_async', 'POST', f"/{rng.choice(codes)}/handleAsync", body, {'Content-Type': 'application/json'}, (202,))]
+
+    def account_page(rng):
+        return [('account_page', 'GET', f"/accounts/{rng.choice(account_rows)[0]}", None, {}, (200,))]
+
+    def extensions(rng):
+        return [('extensions', 'GET', '/extensions', None, {}, (200,))]
+
+    def install_flow(rng):
+        code = rng.choice(codes)
+        account_url = urllib.parse.quote(rng.choice(account_rows)[1], safe='')
+        # The callback carries the state from the install redirect, as the OAuth provider would
+        callback = lambda location: f"/callback/{code}?code={uuid.uuid4().hex}&state={oauth_state(location)}"
+        return [('install', 'GET', f"/{code}/install?account_url={account_url}", None, {}, (302,)),
+                ('callback', 'GET', callback, None, {}, (302,))]
+
+    return {'handle_async': handle_async, 'account_page': account_page, 'extensions': extensions, 'install_flow': install_flow}
+
+def oauth_state(location):
+    return urllib.parse.parse_qs(urllib.parse.urlparse(location or '').query).get('state', [''])[0]
+
+def percentile(timings, p):
+    return timings[max(0, math.ceil(p / 100 * len(timings)) - 1)] if timings else 0.0
+
+def drive(port, make_requests, concurrency, duration):
+    # Each worker keeps one keep-alive connection and issues its requests back to back
+    results, lock = {}, threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def worker(worker_id):
+        rng = random.Random(worker_id)
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+        timings, errors = {}, {}
+        while time.perf_counter() < deadline:
+            location = None
+            for name, method, path, body, headers, expected in make_requests(rng):
+                # A callable path is built from the previous response's Location header
+                path = path(location) if callable(path) else path
+                start = time.perf_counter()
+                try:
+                    conn.request(method, path, body=body, headers=headers)
+                    response = conn.getresponse()
+                    response.read()
+                    location = response.getheader('Location')
+                    ok = response.status in expected
+                except (OSError, http.client.HTTPException):
+                    conn.close()
+                    location = None
+                    ok = False
+                timings.setdefault(name, []).append((time.perf_counter() - start) * 1000)
+                if not ok:
+                    errors[name] = errors.get(name, 0) + 1
+        conn.close()
+        with lock:
+            for name, values in timings.items():
+                entry = results.setdefault(name, {'timings': [], 'errors': 0})
+                entry['timings'].extend(values)
+                entry['errors'] += errors.get(name, 0)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(worker_id,)) for worker_id in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    report = {}
+    for name, entry in results.items():
+        timings = sorted(entry['timings'])
+        report[name] = {
+            'requests': len(timings),
+            'errors': entry['errors'],
+            'throughput_rps': round(len(timings) / elapsed, 1),
+            'p50_ms': round(percentile(timings, 50), 2),
+            'p95_ms': round(percentile(timings, 95), 2),
+            'p99_ms': round(percentile(timings, 99), 2),
+        }
+    return report
+
+def start_app(port, upstream_url, app_log):
+    env = dict(os.environ,
+               PORT=str(port),
+               APP_URL=f"http://127.0.0.1:{port}",
+               SLACK_API_URL=f"{upstream_url}/api",
+               SLACK_TOKEN='xoxb-loadtest')
+    env.setdefault('LOG_LEVEL', 'WARNING')
+    process = subprocess.Popen([sys.executable, 'app.py'], env=env, stdout=app_log, stderr=subprocess.STDOUT)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"app.py exited with {process.returncode}; see {app_log.name}")
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=1)
+            conn.request('GET', '/metrics')
+            if conn.getresponse().status == 200:
+                conn.close()
+                return process
+        except OSError:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError(f"app.py did not start listening on port {port}")
+
+def stop_app(process):
+    # SIGINT lets app.py's finally block stop the outbox cleanly
+    process.send_signal(signal.SIGINT)
+    try:
+        process.wait(timeout=15)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+def outbox_counts():
+    db = db_setup.connect_db()
+    cursor = db.cursor()
+    cursor.execute("SELECT status, COUNT(*) FROM ct_slack_outbox WHERE extension_code LIKE %s GROUP BY status", (CODE_PREFIX + '%',))
+    counts = dict(cursor.fetchall())
+    cursor.close()
+    db.close()
+    return counts
+
+def print_report(report):
+    print(f"{'scenario':<14} {'requests':>9} {'errors':>7} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for name, row in sorted(report.items()):
+        print(f"{name:<14} {row['requests']:>9} {row['errors']:>7} {row['throughput_rps']:>9} {row['p50_ms']:>9} {row['p95_ms']:>9} {row['p99_ms']:>9}")
+
+def compare(report, baseline, tolerance):
+    # A scenario regresses when p95 grows or throughput drops by more than the tolerance
+    regressions = []
+    for name, row in sorted(report.items()):
+        base = baseline['results'].get(name)
+        if not base:
+            continue
+        if row['p95_ms'] > base['p95_ms'] * (1 + tolerance) and row['p95_ms'] - base['p95_ms'] > 1:
+            regressions.append(f"{name}: p95 {base['p95_ms']} ms -> {row['p95_ms']} ms")
+        if row['throughput_rps'] < base['throughput_rps'] * (1 - tolerance):
+            regressions.append(f"{name}: throughput {base['throughput_rps']} -> {row['throughput_rps']} req/s")
+        base_error_rate = base['errors'] / max(base['requests'], 1)
+        if row['errors'] / max(row['requests'], 1) > base_error_rate + 0.01:
+            regressions.append(f"{name}: errors {base['errors']}/{base['requests']} -> {row['errors']}/{row['requests']}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test app.py against local stand-ins for MySQL, Slack and the OAuth/webhooks APIs.')
+    parser.add_argument('--scenario', choices=['all', 'handle_async', 'account_page', 'extensions', 'install_flow'], default='all')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=20, help='seconds per scenario')
+    parser.add_argument('--warmup', type=float, default=2, help='seconds of untimed load per scenario')
+    parser.add_argument('--extensions', type=int, default=200)
+    parser.add_argument('--accounts', type=int, default=500)
+    parser.add_argument('--app-port', type=int, default=8900)
+    parser.add_argument('--upstream-port', type=int, default=8901)
+    for service in ('slack', 'oauth', 'webhooks'):
+        parser.add_argument(f'--{service}-latency-ms', type=float, default=20)
+        parser.add_argument(f'--{service}-error-rate', type=float, default=0.0)
+    parser.add_argument('--baseline', default=BASELINE_PATH)
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--compare', action='store_true')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed p95/throughput change before --compare fails')
+    args = parser.parse_args()
+    if args.compare and not os.path.exists(args.baseline):
+        parser.error(f"no baseline at {args.baseline}; record one with --save-baseline first")
+
+    upstream_url = f"http://127.0.0.1:{args.upstream_port}"
+    services = {service: (getattr(args, f'{service}_latency_ms') / 1000, getattr(args, f'{service}_error_rate'))
+                for service in ('slack', 'oauth', 'webhooks')}
+    upstream = FakeUpstream(('127.0.0.1', args.upstream_port), services)
+    threading.Thread(target=upstream.serve_forever, daemon=True).start()
+
+    create_database()
+    if not db_setup.run_migrations():
+        sys.exit(1)
+    codes, account_rows = seed(args.extensions, args.accounts, upstream_url)
+    all_scenarios = scenarios(codes, account_rows)
+    selected = list(all_scenarios) if args.scenario == 'all' else [args.scenario]
+
+    report = {}
+    with open('loadtest-app.log', 'w') as app_log:
+        process = start_app(args.app_port, upstream_url, app_log)
+        try:
+            for name in selected:
+                print(f"Running {name} with {args.concurrency} connections for {args.duration:g}s...")
+                drive(args.app_port, all_scenarios[name], args.concurrency, args.warmup)
+                report.update(drive(args.app_port, all_scenarios[name], args.concurrency, args.duration))
+        finally:
+            stop_app(process)
+    upstream.shutdown()
+
+    print()
+    print_report(report)
+    print(f"Upstream calls: {dict(sorted(upstream.counts.items()))}")
+    print(f"Outbox rows by status: {outbox_counts()}")
+
+    run = {
+        'concurrency': args.concurrency,
+        'duration': args.duration,
+        'services': {service: {'latency_ms': latency * 1000, 'error_rate': error_rate} for service, (latency, error_rate) in services.items()},
+        'results': report,
+    }
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        with open(args.baseline, 'w') as file:
+            json.dump(run, file, indent=2, sort_keys=True)
+            file.write('\n')
+        print(f"Saved baseline to {args.baseline}")
+    if args.compare:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        if (baseline['concurrency'], baseline['services']) != (run['concurrency'], run['services']):
+            print("Warning: baseline was recorded with different concurrency or upstream settings.")
+        regressions = compare(report, baseline, args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+        print("No regressions against baseline.")
+
+if __name__ == "__main__":
+    main()
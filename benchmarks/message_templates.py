@@ -0,0 +1,120 @@
+# Measures action output rendering: compiled ActionTemplates against parsing the mapping on every event.
+#
+# Needs no database or network. Single-threaded, so the rates are per core. Run from the repository root:
+#
+#   python -m benchmarks.message_templates --events 200000
+import os
+import re
+import json
+import time
+import random
+import argparse
+
+for var, default in [('MYSQL_HOST', 'localhost'), ('MYSQL_USER', 'bench'), ('MYSQL_PASSWORD', 'bench'), ('MYSQL_DB', 'extension_bench'),
+                     ('APP_URL', 'http://localhost:8000'), ('PORT', '8000'), ('SLACK_TOKEN', 'xoxb-bench')]:
+    os.environ.setdefault(var, default)
+
+import app
+
+# (event_input_field, action_output_field) pairs covering each kind of output
+ACTIONS = [
+    ('Number', 'New incident'),
+    ('Number', 'template:Incident {Number} ({Priority}) assigned to {AssignedTo.Name|title}: {ShortDescription|truncate:60}'),
+    ('Status', 'template:{Number} moved to *{Status|upper}* by {UpdatedBy.Name} <{Link|raw}|open>'),
+    ('Number', 'blocks:' + json.dumps([
+        {'type': 'section', 'text': {'type': 'mrkdwn', 'text': '*{Number}* {ShortDescription|truncate:80}'}},
+        {'type': 'context', 'elements': [{'type': 'mrkdwn', 'text': 'Priority {Priority} | {Category|default:Uncategorized}'}]},
+    ])),
+]
+
+def make_event(i):
+    return {
+        'Number': f"INC{i:07d}",
+        'Priority': random.choice(['1 - Critical', '2 - High', '3 - Moderate']),
+        'Status': random.choice(['New', 'In Progress', 'Resolved']),
+        'ShortDescription': 'Printer on floor 3 & the <scanner> are offline again ' * random.randint(1, 3),
+        'AssignedTo': {'Name': 'jordan smith', 'Email': 'jordan@example.com'},
+        'UpdatedBy': {'Name': 'Service Desk'},
+        'Link': f"https://example.service-now.com/incident/{i}",
+        'Category': random.choice([None, 'Hardware', 'Network']),
+    }
+
+NAIVE_FIELD_RE = re.compile(r'\{([^{}]+)\}')
+
+def naive_render(event_input_field, action_output_field, record):
+    # What each event would cost without compilation: parse the mapping, walk paths, format
+    def lookup(spec):
+        path, *filters = spec.split('|')
+        value = record
+        for key in path.split('.'):
+            try:
+                value = value[int(key) if key.isdigit() else key]
+            except (KeyError, IndexError, TypeError):
+                value = None
+                break
+        text = '' if value is None else value if isinstance(value, str) else str(value)
+        raw = False
+        for step in filters:
+            name, _, arg = step.partition(':')
+            if name == 'raw':
+                raw = True
+            elif name == 'default':
+                text = text or arg
+            elif name == 'truncate':
+                text = app.truncate_text(text, int(arg or 80))
+            else:
+                text = getattr(text, name)()
+        return text if raw else app.slack_escape(text)
+
+    def fill(value):
+        if isinstance(value, str):
+            return NAIVE_FIELD_RE.sub(lambda m: lookup(m.group(1)), value)
+        if isinstance(value, list):
+            return [fill(item) for item in value]
+        if isinstance(value, dict):
+            return {key: fill(item) for key, item in value.items()}
+        return value
+
+    if record.get(event_input_field) is None:
+        return None
+    kind, _, source = action_output_field.partition(':')
+    if kind == 'blocks':
+        blocks = fill(json.loads(source))
+        texts = [block['text']['text'] for block in blocks if isinstance(block.get('text'), dict)]
+        return app.truncate_text('\n'.join(texts), app.SLACK_MAX_SECTION_CHARS), json.dumps(blocks, ensure_ascii=False)
+    if kind == 'template':
+        return fill(source), None
+    return f"{action_output_field}: {lookup(event_input_field)}", None
+
+def measure(label, render, events, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for event in events:
+            render(event)
+        best = min(best, time.perf_counter() - start)
+    rate = len(events) / best
+    print(f"{label:<44} {rate:>12,.0f} events/s   {best / len(events) * 1e6:6.2f} µs/event")
+    return rate
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark action output rendering.')
+    parser.add_argument('--events', type=int, default=200000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    random.seed(1)
+    events = [make_event(i) for i in range(args.events)]
+    for index, (event_input_field, action_output_field) in enumerate(ACTIONS):
+        template = app.ActionTemplate(event_input_field, action_output_field)
+        for event in events[:1000]:
+            assert template.render(event) == naive_render(event_input_field, action_output_field, event)
+        print(f"action {index}: {template.render(events[0])[0][:90]!r}")
+        print()
+        naive = measure('  parsed per event', lambda event: naive_render(event_input_field, action_output_field, event), events, args.repeat)
+        compiled = measure('  compiled ActionTemplate', template.render, events, args.repeat)
+        print(f"  speedup {compiled / naive:.1f}x")
+        print()
+
+if __name__ == "__main__":
+    main()
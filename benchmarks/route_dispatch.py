@@ -0,0 +1,110 @@
+# Measures per-request dispatch cost of the compiled route table against the if/elif chain it replaced.
+#
+# Needs no database or network. Run from the repository root:
+#
+#   python -m benchmarks.route_dispatch --number 200000
+import os
+import timeit
+import argparse
+
+for var, default in [('MYSQL_HOST', 'localhost'), ('MYSQL_USER', 'bench'), ('MYSQL_PASSWORD', 'bench'), ('MYSQL_DB', 'extension_bench'),
+                     ('APP_URL', 'http://localhost:8000'), ('PORT', '8000'), ('SLACK_TOKEN', 'xoxb-bench')]:
+    os.environ.setdefault(var, default)
+
+import app
+
+# One request per route, plus a miss for each method
+REQUESTS = [
+    ('GET', '/'),
+    ('GET', '/assets/lib/bootstrap-5.1.3-dist/css/bootstrap.min.css'),
+    ('GET', '/extensions?after=100&limit=50'),
+    ('GET', '/extension-add'),
+    ('GET', '/accounts'),
+    ('GET', '/accounts/42'),
+    ('GET', '/account-add'),
+    ('GET', '/callback/a1b2c3?code=xyz'),
+    ('GET', '/a1b2c3/install?account_url=https://example.com'),
+    ('GET', '/k9x8y7/actions/'),
+    ('GET', '/k9x8y7/action-add'),
+    ('GET', '/k9x8y7/ws-profile/'),
+    ('GET', '/does/not/exist'),
+    ('POST', '/submit_extension'),
+    ('POST', '/submit_account'),
+    ('POST', '/update_ws_profile'),
+    ('POST', '/submit_action'),
+    ('POST', '/a1b2c3/handleAsync'),
+    ('POST', '/does-not-exist'),
+]
+
+def legacy_dispatch(method, path):
+    # The do_GET/do_POST chain as it was, returning the handler it would have run
+    if method == 'GET':
+        if path == '/':
+            return 'show_index'
+        elif path.startswith('/assets'):
+            return 'send_asset'
+        elif path.startswith('/extensions'):
+            return 'show_extensions'
+        elif path.startswith('/extension-add'):
+            return 'show_extension_add'
+        elif path.startswith('/accounts/'):
+            return 'show_account'
+        elif path.startswith('/accounts'):
+            return 'show_accounts'
+        elif path.startswith('/account-add'):
+            return 'show_account_add'
+        elif '/install' in path:
+            return 'install_extension'
+        elif path.startswith('/callback'):
+            return 'oauth_callback'
+        elif '/actions' in path:
+            return 'show_actions'
+        elif '/action-add' in path:
+            return 'show_action_add'
+        elif '/ws-profile/' in path:
+            return 'show_ws_profile'
+        return None
+    if path == '/submit_extension':
+        return 'post_extension'
+    elif path == '/submit_account':
+        return 'post_account'
+    elif path == '/update_ws_profile':
+        return 'post_ws_profile'
+    elif path == '/submit_action':
+        return 'post_action'
+    elif '/handleAsync' in path:
+        return 'handle_async'
+    return None
+
+def compiled_dispatch(method, path):
+    route = app.router.match(method, path.partition('?')[0])
+    return route and route[0]
+
+def measure(label, dispatch, number):
+    def run():
+        for method, path in REQUESTS:
+            dispatch(method, path)
+    best = min(timeit.repeat(run, number=number // len(REQUESTS), repeat=5))
+    per_call = best / (number // len(REQUESTS) * len(REQUESTS)) * 1e9
+    print(f"{label:<24} {per_call:8.0f} ns per dispatch")
+    return per_call
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark request routing across all current routes.')
+    parser.add_argument('--number', type=int, default=200000, help='dispatches per timing run')
+    args = parser.parse_args()
+
+    for method, path in REQUESTS:
+        print(f"{method:<5} {path:<60} {compiled_dispatch(method, path)}")
+    print()
+    measure('if/elif chain', legacy_dispatch, args.number)
+    measure('compiled route trie', compiled_dispatch, args.number)
+    # Per-route cost shows how the chain degrades for routes near its end while the trie stays flat
+    print()
+    for method, path in REQUESTS:
+        legacy = min(timeit.repeat(lambda: legacy_dispatch(method, path), number=args.number // 10, repeat=3)) / (args.number // 10) * 1e9
+        compiled = min(timeit.repeat(lambda: compiled_dispatch(method, path), number=args.number // 10, repeat=3)) / (args.number // 10) * 1e9
+        print(f"{method:<5} {path:<60} chain {legacy:6.0f} ns   trie {compiled:6.0f} ns")
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,5 @@
 import os
+import sys
 import mysql.connector
 from mysql.connector import Error
 from dotenv import load_dotenv
@@ -6,16 +7,19 @@ from dotenv import load_dotenv
 # Load environment variables from .env file
 load_dotenv()
 
+def connect_db():
+    return mysql.connector.connect(
+        host=os.getenv('MYSQL_HOST'),
+        user=os.getenv('MYSQL_USER'),
+        password=os.getenv('MYSQL_PASSWORD'),
+        database=os.getenv('MYSQL_DB')
+    )
+
 def setup_database():
     db = None
     cursor = None
     try:
-        db = mysql.connector.connect(
-            host=os.getenv('MYSQL_HOST'),
-            user=os.getenv('MYSQL_USER'),
-            password=os.getenv('MYSQL_PASSWORD'),
-            database=os.getenv('MYSQL_DB')
-        )
+        db = connect_db()
         
         if db.is_connected():
             cursor = db.cursor()
@@ -90,15 +94,17 @@ def setup_database():
             cursor.execute('''
             CREATE TABLE IF NOT EXISTS ct_extension_actions (
                 action_id INT AUTO_INCREMENT PRIMARY KEY,
-                action_name VARCHAR(255) NOT NULL,
-                action_code VARCHAR(6) NOT NULL UNIQUE,
                 extension_installation_pk INT NOT NULL,
                 profile_id INT NOT NULL,
-                table_source VARCHAR(255) NOT NULL,
+                webhook_event_id VARCHAR(6) NOT NULL,
+                action_name VARCHAR(255) NOT NULL,
+                action_code VARCHAR(6) NOT NULL,
+                event_object VARCHAR(255) NOT NULL,
                 event_type VARCHAR(255) NOT NULL,
-                message TEXT NOT NULL,
-                response_field_mapped_to VARCHAR(255),
-                webhook_event_id INT NULL,
+                event_input_field TEXT NOT NULL,
+                action_object VARCHAR(255) NOT NULL,
+                action_type VARCHAR(255) NOT NULL,
+                action_output_field TEXT NOT NULL,
                 FOREIGN KEY (extension_installation_pk) REFERENCES ct_extension_installations(pk) ON DELETE CASCADE,
                 FOREIGN KEY (profile_id) REFERENCES ct_extension_profiles(profile_id) ON DELETE CASCADE
             )
@@ -126,6 +132,25 @@ def setup_database():
             )
             ''')
 
+            # Create the ct_slack_outbox table
+            cursor.execute('''
+            CREATE TABLE IF NOT EXISTS ct_slack_outbox (
+                id BIGINT AUTO_INCREMENT PRIMARY KEY,
+                extension_code VARCHAR(6) NOT NULL,
+                channel VARCHAR(255) NULL,
+                message TEXT NULL,
+                status VARCHAR(16) NOT NULL DEFAULT 'pending',
+                attempts INT NOT NULL DEFAULT 0,
+                next_attempt_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                claim_token VARCHAR(32) NULL,
+                last_error VARCHAR(255) NULL,
+                created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                sent_at DATETIME NULL,
+                INDEX idx_outbox_due (status, next_attempt_at),
+                INDEX idx_outbox_claim (claim_token)
+            )
+            ''')
+
             db.commit()
             print("Database setup completed successfully.")
 
@@ -139,5 +164,200 @@ def setup_database():
             db.close()
             print("Database connection closed.")
 
+def index_exists(cursor, table, index_name, columns):
+    # An index counts as present if it has the same name, or if another index (such as the one
+    # InnoDB creates implicitly for a foreign key) already leads with the same columns.
+    cursor.execute('''
+        SELECT index_name, GROUP_CONCAT(column_name ORDER BY seq_in_index)
+        FROM information_schema.statistics
+        WHERE table_schema = DATABASE() AND table_name = %s
+        GROUP BY index_name
+    ''', (table,))
+    wanted = ','.join(columns)
+    return any(name == index_name or indexed_columns.startswith(wanted) for name, indexed_columns in cursor.fetchall())
+
+def ensure_index(cursor, table, index_name, columns, unique=False):
+    if index_exists(cursor, table, index_name, columns):
+        return
+    kind = 'UNIQUE INDEX' if unique else 'INDEX'
+    cursor.execute(f"CREATE {kind} {index_name} ON {table} ({', '.join(columns)})")
+
+def migration_001_lookup_indexes(cursor):
+    ensure_index(cursor, 'ct_extensions', 'uq_extensions_code', ['extension_code'], unique=True)
+    ensure_index(cursor, 'ct_extension_installations', 'uq_installations_id', ['installation_id'], unique=True)
+    ensure_index(cursor, 'ct_accounts', 'idx_accounts_url', ['acct_url'])
+    ensure_index(cursor, 'ct_ws_profiles', 'idx_ws_profiles_installation', ['extension_installation_pk'])
+    ensure_index(cursor, 'ct_webhooks', 'idx_webhooks_installation', ['extension_installation_pk'])
+
+def migration_002_catalog_index(cursor):
+    # Covers the per-account anti-join in the /accounts/<id> extension catalog
+    ensure_index(cursor, 'ct_extension_installations', 'idx_installations_account_extension', ['account_id', 'extension_pk'])
+
+def migration_003_webhook_deliveries(cursor):
+    # Dedupe store for /handleAsync retries, used when DEDUPE_DB_STORE is enabled
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS ct_webhook_deliveries (
+        extension_code VARCHAR(255) NOT NULL,
+        delivery_key VARCHAR(255) NOT NULL,
+        created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (extension_code, delivery_key),
+        INDEX idx_webhook_deliveries_created (created_at)
+    )
+    ''')
+
+def ensure_column(cursor, table, column, definition):
+    cursor.execute('''
+        SELECT 1 FROM information_schema.columns
+        WHERE table_schema = DATABASE() AND table_name = %s AND column_name = %s
+    ''', (table, column))
+    if cursor.fetchall():
+        return
+    cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+def migration_004_outbox_blocks(cursor):
+    # Block Kit output rendered from action templates, sent alongside the text fallback
+    ensure_column(cursor, 'ct_slack_outbox', 'blocks', 'TEXT NULL')
+
+def migration_005_outbox_installation(cursor):
+    # Which installation's bot token posts the message; NULL uses SLACK_TOKEN
+    ensure_column(cursor, 'ct_slack_outbox', 'extension_installation_pk', 'INT NULL')
+
+def migration_006_oauth_states(cursor):
+    # OAuth state -> pending installation, so a callback attaches its token to the right install
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS ct_oauth_states (
+        state VARCHAR(64) NOT NULL PRIMARY KEY,
+        extension_installation_pk INT NOT NULL,
+        account_id INT NOT NULL,
+        extension_code VARCHAR(255) NOT NULL,
+        used TINYINT NOT NULL DEFAULT 0,
+        created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        INDEX idx_oauth_states_created (created_at),
+        FOREIGN KEY (extension_installation_pk) REFERENCES ct_extension_installations(pk) ON DELETE CASCADE
+    )
+    ''')
+
+# Append new migrations here; versions are applied in order and never re-run.
+MIGRATIONS = [
+    (1, 'lookup indexes', migration_001_lookup_indexes),
+    (2, 'extension catalog index', migration_002_catalog_index),
+    (3, 'webhook delivery dedupe table', migration_003_webhook_deliveries),
+    (4, 'outbox Block Kit column', migration_004_outbox_blocks),
+    (5, 'outbox installation column', migration_005_outbox_installation),
+    (6, 'OAuth state table', migration_006_oauth_states),
+]
+
+def run_migrations():
+    setup_database()
+    db = None
+    cursor = None
+    try:
+        db = connect_db()
+        cursor = db.cursor()
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS ct_schema_migrations (
+            version INT PRIMARY KEY,
+            name VARCHAR(255) NOT NULL,
+            applied_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+        ''')
+        cursor.execute('SELECT version FROM ct_schema_migrations')
+        applied = {version for (version,) in cursor.fetchall()}
+
+        for version, name, migrate in MIGRATIONS:
+            if version in applied:
+                continue
+            # DDL commits implicitly in MySQL, so migrations must be safe to re-run after a failure
+            migrate(cursor)
+            cursor.execute('INSERT INTO ct_schema_migrations (version, name) VALUES (%s, %s)', (version, name))
+            db.commit()
+            print(f"Applied migration {version}: {name}")
+
+        print("Database migrations completed successfully.")
+        return True
+
+    except Error as e:
+        print(f"Database error: {e}")
+        return False
+
+    finally:
+        if cursor:
+            cursor.close()
+        if db and db.is_connected():
+            db.close()
+
+# The hot lookups from app.py, with sample parameters. Keep in sync with the queries there.
+HOT_QUERIES = [
+    ('get_extension_by_code', 'SELECT pk, extension_code, extension_name, description, authorization_url, token_url, client_id, client_secret, scope FROM ct_extensions WHERE extension_code = %s', ('abc123',)),
+    ('load_installation_page', '''
+        SELECT ei.pk, ei.account_id, e.extension_code, a.acct_name, a.acct_url, wsp.profile_id, wsp.profile_name
+        FROM ct_extension_installations ei
+        JOIN ct_extensions e ON ei.extension_pk = e.pk
+        LEFT JOIN ct_accounts a ON ei.account_id = a.acct_id
+        LEFT JOIN ct_ws_profiles wsp ON wsp.extension_installation_pk = ei.pk
+        WHERE ei.installation_id = %s
+        ORDER BY wsp.profile_id
+        LIMIT 1
+    ''', ('abc123',)),
+    ('get_account_by_id', 'SELECT acct_id, acct_name, acct_friendly_name, acct_url, disabled FROM ct_accounts WHERE acct_id = %s', (1,)),
+    ('get_account_by_url', 'SELECT acct_id, acct_name, acct_friendly_name, acct_url, disabled FROM ct_accounts WHERE acct_url = %s', ('https://example.com',)),
+    ('get_ws_profile_by_id', 'SELECT wsp.profile_id, wsp.account_id, wsp.profile_name, wsp.app_key, wsp.app_secret, wsp.token_url, wsp.extension_installation_pk FROM ct_ws_profiles wsp JOIN ct_extension_installations ei ON wsp.extension_installation_pk = ei.pk WHERE wsp.extension_installation_pk = %s', (1,)),
+    ('get_webhook_by_id', 'SELECT w.id, w.webhook_code, w.webhook_name, w.secret, w.extension_installation_pk FROM ct_webhooks w JOIN ct_extension_installations ei ON w.extension_installation_pk = ei.pk WHERE w.extension_installation_pk = %s', (1,)),
+    ('load_actions_page', '''
+        SELECT ei.pk, ei.account_id, e.extension_code, a.acct_name, a.acct_url,
+            ea.action_id, ea.action_name, ea.action_code, ea.event_object, ea.event_type,
+            ea.event_input_field, ea.action_object, ea.action_type, ea.action_output_field
+        FROM ct_extension_installations ei
+        JOIN ct_extensions e ON ei.extension_pk = e.pk
+        LEFT JOIN ct_accounts a ON ei.account_id = a.acct_id
+        LEFT JOIN ct_extension_actions ea ON ea.extension_installation_pk = ei.pk
+            AND ea.action_id > %s
+        WHERE ei.installation_id = %s
+        ORDER BY ea.action_id
+        LIMIT %s
+    ''', (0, 'abc123', 101)),
+    ('get_extension_catalog', '''
+        SELECT e.extension_name, e.description, wsp.app_key, wsp.app_secret, ei.installation_id, e.extension_code, wsp.profile_id
+        FROM ct_extensions e
+        LEFT JOIN ct_extension_installations ei ON ei.extension_pk = e.pk AND ei.account_id = %s
+        LEFT JOIN ct_ws_profiles wsp ON wsp.extension_installation_pk = ei.pk
+        ORDER BY e.pk, ei.pk
+    ''', (1,)),
+]
+
+# Queries that list a whole table by design
+FULL_SCAN_ALLOWED = {
+    'get_extension_catalog': {'e'},
+}
+
+def check_query_plans():
+    db = None
+    cursor = None
+    failures = []
+    try:
+        db = connect_db()
+        cursor = db.cursor(dictionary=True)
+        for name, query, params in HOT_QUERIES:
+            cursor.execute('EXPLAIN ' + query, params)
+            for row in cursor.fetchall():
+                if row['type'] == 'ALL' and row['table'] not in FULL_SCAN_ALLOWED.get(name, ()):
+                    failures.append(f"{name}: full table scan on {row['table']}")
+    except Error as e:
+        print(f"Database error: {e}")
+        return False
+    finally:
+        if cursor:
+            cursor.close()
+        if db and db.is_connected():
+            db.close()
+
+    for failure in failures:
+        print(failure)
+    if not failures:
+        print(f"All {len(HOT_QUERIES)} hot queries use an index.")
+    return not failures
+
 if __name__ == "__main__":
-    setup_database()
\ No newline at end of file
+    if '--check-plans' in sys.argv:
+        sys.exit(0 if check_query_plans() else 1)
+    sys.exit(0 if run_migrations() else 1)
\ No newline at end of file
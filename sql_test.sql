@@ -1,3 +1,6 @@
+DROP TABLE IF EXISTS extension_db.ct_oauth_states;
+DROP TABLE IF EXISTS extension_db.ct_webhook_deliveries;
+DROP TABLE IF EXISTS extension_db.ct_slack_outbox;
 DROP TABLE IF EXISTS extension_db.ct_webhook_urls;
 DROP TABLE IF EXISTS extension_db.ct_webhooks;
 DROP TABLE IF EXISTS extension_db.ct_extension_actions;
@@ -81,4 +84,38 @@ CREATE TABLE IF NOT EXISTS extension_db.ct_webhook_urls (
                 url VARCHAR(255) NOT NULL,                      
                 webhook_id INT NOT NULL,                         
                 FOREIGN KEY (webhook_id) REFERENCES ct_webhooks(id) ON DELETE CASCADE 
+            );
+CREATE TABLE IF NOT EXISTS extension_db.ct_slack_outbox (
+                id BIGINT AUTO_INCREMENT PRIMARY KEY,
+                extension_code VARCHAR(6) NOT NULL,
+                channel VARCHAR(255) NULL,
+                message TEXT NULL,
+                status VARCHAR(16) NOT NULL DEFAULT 'pending',
+                attempts INT NOT NULL DEFAULT 0,
+                next_attempt_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                claim_token VARCHAR(32) NULL,
+                last_error VARCHAR(255) NULL,
+                created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                sent_at DATETIME NULL,
+                blocks TEXT NULL,
+                extension_installation_pk INT NULL,
+                INDEX idx_outbox_due (status, next_attempt_at),
+                INDEX idx_outbox_claim (claim_token)
+            );
+CREATE TABLE IF NOT EXISTS extension_db.ct_webhook_deliveries (
+                extension_code VARCHAR(255) NOT NULL,
+                delivery_key VARCHAR(255) NOT NULL,
+                created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (extension_code, delivery_key),
+                INDEX idx_webhook_deliveries_created (created_at)
+            );
+CREATE TABLE IF NOT EXISTS extension_db.ct_oauth_states (
+                state VARCHAR(64) NOT NULL PRIMARY KEY,
+                extension_installation_pk INT NOT NULL,
+                account_id INT NOT NULL,
+                extension_code VARCHAR(255) NOT NULL,
+                used TINYINT NOT NULL DEFAULT 0,
+                created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                INDEX idx_oauth_states_created (created_at),
+                FOREIGN KEY (extension_installation_pk) REFERENCES ct_extension_installations(pk) ON DELETE CASCADE
             );
\ No newline at end of file